@@ -0,0 +1,185 @@
+# Benchmarks for the register, numeric and bus hot paths, on the simulated pins and buses of adapters.simulator.
+#
+#   python run_benchmarks.py                           # run all, print ops/s and peak memory per call
+#   python run_benchmarks.py -k i2c                    # only benchmarks whose name contains 'i2c'
+#   python run_benchmarks.py --save baseline.json      # store results as a baseline
+#   python run_benchmarks.py --baseline baseline.json  # compare, exit 1 if any is slower than the threshold
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from utilities.adapters.peripherals import I2C, SPI
+from utilities.adapters.simulator import SimulatedDevice, SimulatedI2C, SimulatedPin, SimulatedSPI
+from utilities.numeric import Float, Number, SignedInteger
+from utilities.register import Element, Register, RegistersMap
+from utilities.shift_register import ShiftRegister
+
+
+
+def get_registers_map(n_registers = 64):
+    registers = [Register('REG_{}'.format(i), address = i, default_value = i,
+                          elements = [Element('E_{}_LO'.format(i), 0, 4), Element('E_{}_HI'.format(i), 4, 3),
+                                      Element('E_{}_RO'.format(i), 7, 1, read_only = True)])
+                 for i in range(n_registers)]
+
+    return RegistersMap('benchmark', registers = registers)
+
+
+
+def get_benchmarks():
+    benchmarks = {}
+    rm = get_registers_map()
+    register = rm.registers['REG_1']
+    addressed_values = [(i, (i * 37) & 0xFF) for i in range(64)]
+    addressed_values_2 = [(i, (i * 91) & 0xFF) for i in range(64)]
+    json_string = rm.dumps()
+
+    benchmarks['register.value'] = lambda: register.value
+    benchmarks['register.load_value'] = lambda: register.load_value(0xA5)
+    benchmarks['registers_map.load_values'] = lambda: rm.load_values(addressed_values)
+    benchmarks['registers_map.dumps'] = rm.dumps
+    benchmarks['registers_map.loads'] = lambda: rm.loads(json_string)
+
+    try:
+        import numpy
+
+        benchmarks['registers_map.compare_values_sets'] = \
+            lambda: rm.compare_values_sets(addressed_values, addressed_values_2)
+    except ImportError:
+        pass
+
+    try:
+        import pandas
+
+        benchmarks['registers_map.df'] = lambda: rm.df
+    except ImportError:
+        pass
+
+    for name, cls, value, n_bits_A, n_bits_B in (('float', Float, -3.14159, None, None),
+                                                 ('signed', SignedInteger, -123456, None, None),
+                                                 ('q16.16', Number, 12.5, 16, 16)):
+        as_bytes = cls.to_bytes(value, n_bits_A, n_bits_B)
+        benchmarks['numeric.{}.to_bits'.format(name)] = \
+            lambda cls = cls, value = value, a = n_bits_A, b = n_bits_B: cls.to_bits(value, a, b)
+        benchmarks['numeric.{}.from_bytes'.format(name)] = \
+            lambda cls = cls, as_bytes = as_bytes, a = n_bits_A, b = n_bits_B: cls.from_bytes(as_bytes, a, b)
+
+    shift_register = ShiftRegister(SimulatedPin(), SimulatedPin(), SimulatedPin())
+    payload = bytes(range(16))
+    benchmarks['shift_register.write_16'] = lambda: shift_register.write(payload)
+    benchmarks['shift_register.shiftIn'] = shift_register.shiftIn
+
+    i2c_bus = SimulatedI2C()
+    i2c_bus.add_device(0x40, rm)
+    i2c = I2C(i2c_bus, backend = 'Virtual')
+    buf = bytearray(16)
+    addresses = list(range(0, 64, 2))
+    benchmarks['i2c.read_addressed_byte'] = lambda: i2c.read_addressed_byte(0x40, 3)
+    benchmarks['i2c.read_addressed_bytes_16'] = lambda: i2c.read_addressed_bytes(0x40, 0, 16)
+    benchmarks['i2c.read_addressed_into_16'] = lambda: i2c.read_addressed_into(0x40, 0, buf)
+    benchmarks['i2c.write_addressed_bytes_16'] = lambda: i2c.write_addressed_bytes(0x40, 0, payload)
+    benchmarks['i2c.read_registers_32'] = lambda: i2c.read_registers(0x40, addresses, max_gap = 1)
+
+    spi_bus = SimulatedSPI(SimulatedDevice(rm))
+    spi = SPI(spi_bus, spi_bus.ss_pin, backend = 'Virtual')
+    benchmarks['spi.write_16'] = lambda: spi.write(payload)
+    benchmarks['spi.write_readinto_16'] = lambda: spi.write_readinto(payload, buf)
+
+    return benchmarks
+
+
+
+def measure(func, min_time = 0.2):
+    # calibrate a loop count that takes about min_time, keep the best of three.
+    n = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(n):
+            func()
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_time / 10:
+            break
+        n *= 10
+
+    n = max(1, int(n * min_time / max(elapsed, 1e-9) / 3))
+    best = float('inf')
+    for _ in range(3):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            func()
+        best = min(best, time.perf_counter() - t0)
+
+    tracemalloc.start()
+    func()
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'ops_per_s': n / best, 'peak_bytes': peak - start}
+
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result['ops_per_s'] / baseline[name]['ops_per_s']
+            result['ratio'] = ratio
+            if ratio < 1 - threshold:
+                regressions.append(name)
+
+    return regressions
+
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmarks for utilities hot paths.')
+    parser.add_argument('-k', '--filter', default = '', help = 'run only benchmarks whose name contains this.')
+    parser.add_argument('--min-time', type = float, default = 0.2, help = 'seconds per benchmark.')
+    parser.add_argument('--save', help = 'save results to this json file.')
+    parser.add_argument('--baseline', help = 'compare with the results in this json file.')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'allowed slow down, 0.2 is 20%%.')
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = {}
+    print('{:<40s}{:>14s}{:>14s}{:>10s}'.format('benchmark', 'ops/s', 'peak bytes', 'ratio'))
+
+    for name, func in get_benchmarks().items():
+        if args.filter in name:
+            results[name] = measure(func, args.min_time)
+            ratio = results[name]['ops_per_s'] / baseline[name]['ops_per_s'] if name in baseline else None
+            print('{:<40s}{:>14.0f}{:>14d}{:>10s}'.format(name, results[name]['ops_per_s'],
+                                                          results[name]['peak_bytes'],
+                                                          '' if ratio is None else '{:.2f}'.format(ratio)))
+
+    if args.save:
+        with open(args.save, 'wt') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print('\nRegressions (more than {:.0%} slower than baseline):'.format(args.threshold))
+        for name in regressions:
+            print('  {}: {:.2f}x'.format(name, results[name]['ratio']))
+        return 1
+
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from utilities.adapters.async_peripherals import AsyncI2C
+from utilities.adapters.peripherals import I2C
+
+
+
+def test_same_bus_in_two_event_loops():
+    bus = AsyncI2C(I2C(None))
+
+    async def read():
+        async with bus.transaction():
+            return await bus.read_addressed_byte(0x40, 0)
+
+    assert asyncio.run(read()) == 0
+    assert asyncio.run(read()) == 0
+    bus.close()
+
+
+
+def test_closed_bus_raises():
+    bus = AsyncI2C(I2C(None))
+    bus.close()
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(bus.read_byte(0x40))
+
+
+
+class RecordingI2C:
+    # machine.I2C like, logs each call.
+
+    def __init__(self):
+        self.log = []
+
+
+    def writeto(self, i2c_address, buf):
+        self.log.append(('w', bytes(buf)[0]))
+        time.sleep(0.005)
+
+
+    def readfrom(self, i2c_address, n_bytes):
+        self.log.append(('r', i2c_address))
+        return bytes(n_bytes)
+
+
+    def writeto_mem(self, i2c_address, reg_address, buf):
+        pass
+
+
+
+def test_transaction_is_atomic_across_event_loops():
+    i2c = I2C(RecordingI2C(), backend = 'uPy')
+
+
+    def worker(i2c_address):
+        async def transact():
+            async with AsyncI2C(i2c) as bus:
+                for _ in range(5):
+                    async with bus.transaction():
+                        await bus.write_bytes(i2c_address, bytes([i2c_address]))
+                        await asyncio.sleep(0.002)
+                        await bus.read_bytes(i2c_address, 1)
+
+        asyncio.run(transact())
+
+
+    threads = [threading.Thread(target = worker, args = (i2c_address,)) for i2c_address in (1, 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    log = i2c._bus.log
+    assert len(log) == 20
+    for i in range(0, len(log), 2):
+        assert log[i][0] == 'w' and log[i + 1] == ('r', log[i][1])
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from utilities.adapters import peripherals
+from utilities.adapters.peripherals import I2C, SPI, Pin
+from utilities.adapters.simulator import SimulatedI2C, SimulatedPin, SimulatedSPI
+
+
+
+@pytest.fixture
+def default_backend():
+    saved = peripherals._default_backend
+    yield
+    peripherals._default_backend = saved
+
+
+
+def test_import_opens_no_bridge():
+    code = '; '.join(['import sys',
+                      'from utilities.adapters import peripherals',
+                      'assert not [m for m in sys.modules if m.split(".")[0] == "bridges"], sys.modules',
+                      'assert peripherals._gpio_port is None',
+                      'assert peripherals._default_backend is None'])
+
+    subprocess.run([sys.executable, '-c', code], check = True,
+                   cwd = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+
+def test_set_default_backend_dispatches(default_backend):
+    peripherals.set_default_backend('Virtual')
+
+    assert peripherals.get_backend() == 'Virtual'
+    assert isinstance(Pin.get_pin(3), SimulatedPin)
+    assert isinstance(I2C.get_i2c(), SimulatedI2C)
+    assert isinstance(SPI.get_spi(), SimulatedSPI)
+    assert I2C(I2C.get_i2c()).backend == 'Virtual'
+
+
+
+def test_unknown_backend_rejected(default_backend):
+    with pytest.raises(AssertionError):
+        peripherals.get_backend('Arduino')
+
+    with pytest.raises(AssertionError):
+        peripherals.set_default_backend('Arduino')
+
+    with pytest.raises(AssertionError):
+        Pin.get_pin(3, backend = 'Arduino')
@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+
+from utilities.adapters.broker import BrokerI2C, BrokerSPI, BusBroker
+from utilities.adapters.peripherals import I2C, SPI
+from utilities.adapters.simulator import SimulatedDevice, SimulatedI2C, SimulatedSPI
+from utilities.register import Element, Register, RegistersMap
+
+
+
+def get_bus():
+    bus = SimulatedI2C()
+    bus.add_device(0x40, RegistersMap('m', registers = [Register('R{}'.format(i), address = i,
+                                                                 elements = [Element('E{}'.format(i), 0, 8)])
+                                                        for i in range(8)]))
+    return I2C(bus, backend = 'Virtual')
+
+
+
+def test_end_to_end(tmp_path):
+    path = str(tmp_path / 'i2c.sock')
+    broker = BusBroker(get_bus(), path).start()
+    client = BrokerI2C(path)
+
+    try:
+        with client.pipelined():
+            client.write_addressed_bytes(0x40, 2, b'\x01\x02')
+            client.write_addressed_byte(0x40, 5, 7)
+
+        assert bytes(client.read_addressed_bytes(0x40, 1, 3)) == b'\x00\x01\x02'
+        assert client.read_registers(0x40, [2, 5], max_gap = 1) == {2: 1, 5: 7}
+    finally:
+        client.close()
+        broker.stop()
+
+
+
+def test_restart_on_same_path(tmp_path):
+    path = str(tmp_path / 'i2c.sock')
+
+    for _ in range(2):
+        broker = BusBroker(get_bus(), path).start()
+        client = BrokerI2C(path)
+        assert client.read_addressed_byte(0x40, 0) == 0
+        client.close()
+        broker.stop()
+
+    assert not os.path.exists(path)
+
+
+
+def get_spi_bus():
+    rm = RegistersMap('m', registers = [Register('R{}'.format(i), address = i,
+                                                 elements = [Element('E{}'.format(i), 0, 8)])
+                                        for i in range(8)])
+    spi_bus = SimulatedSPI(SimulatedDevice(rm))
+    return spi_bus, SPI(spi_bus, spi_bus.ss_pin, backend = 'Virtual')
+
+
+
+def test_spi_transaction_spans_requests(tmp_path):
+    path = str(tmp_path / 'spi.sock')
+    spi_bus, spi = get_spi_bus()
+    broker = BusBroker(spi, path).start()
+    client = BrokerSPI(path)
+    buf = bytearray(2)
+
+    try:
+        with client.transaction():
+            client.write(b'\x01')
+            client.write(b'\x09\x0a')
+
+        with client.transaction():
+            client.write(b'\x81')
+            client.readinto(buf)
+    finally:
+        client.close()
+        broker.stop()
+
+    assert spi_bus.device.memory[1:3] == b'\x09\x0a'
+    assert buf == b'\x09\x0a'
+
+
+
+def test_spi_transaction_defers_other_clients(tmp_path):
+    path = str(tmp_path / 'spi.sock')
+    spi_bus, spi = get_spi_bus()
+    broker = BusBroker(spi, path).start()
+    owner = BrokerSPI(path)
+    other = BrokerSPI(path)
+
+    try:
+        with owner.transaction():
+            owner.write(b'\x01')
+            thread = threading.Thread(target = other.write, args = (b'\x05\x07',))
+            thread.start()
+            time.sleep(0.05)
+            owner.write(b'\x09')
+        thread.join()
+    finally:
+        owner.close()
+        other.close()
+        broker.stop()
+
+    assert spi_bus.device.memory[1] == 0x09
+    assert spi_bus.device.memory[5] == 0x07
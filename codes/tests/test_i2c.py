@@ -0,0 +1,84 @@
+from utilities.adapters.instrumentation import Instrumentation
+from utilities.adapters.peripherals import I2C
+from utilities.adapters.simulator import SimulatedI2C
+from utilities.register import Element, Register, RegistersMap
+
+
+
+class BufferOnlyI2C:
+    # machine.I2C refuses objects without the buffer protocol.
+
+    def __init__(self):
+        self.log = []
+
+
+    def writeto(self, i2c_address, buf):
+        self.log.append(bytes(memoryview(buf)))
+
+
+    def writeto_mem(self, i2c_address, reg_address, buf):
+        self.log.append((reg_address, bytes(memoryview(buf))))
+
+
+    def writevto(self, i2c_address, buffers):
+        self.log.append(b''.join(bytes(memoryview(buf)) for buf in buffers))
+
+
+    def readfrom_mem_into(self, i2c_address, reg_address, buf):
+        pass
+
+
+    def readfrom_into(self, i2c_address, buf):
+        pass
+
+
+
+def test_write_addressed_bytes_accepts_lists():
+    i2c = I2C(BufferOnlyI2C(), backend = 'uPy')
+
+    assert i2c.write_addressed_bytes(0x40, 3, [1, 2]) == 2
+    i2c.write_addressed_bytes(0x40, 5, b'\x03')
+    i2c.write_vectored(0x40, ([7], b'\x08'))
+
+    assert i2c._bus.log == [(3, b'\x01\x02'), (5, b'\x03'), b'\x07\x08']
+
+
+
+def test_plan_block_reads_empty():
+    assert I2C.plan_block_reads([]) == []
+
+
+
+def test_plan_block_reads_merges_contiguous_and_duplicates():
+    assert I2C.plan_block_reads([3, 1, 2, 2, 1, 7]) == [(1, 3), (7, 1)]
+
+
+
+def test_plan_block_reads_gap_tolerance():
+    addresses = [0, 2, 5, 9]
+
+    assert I2C.plan_block_reads(addresses, max_gap = 0) == [(0, 1), (2, 1), (5, 1), (9, 1)]
+    assert I2C.plan_block_reads(addresses, max_gap = 1) == [(0, 3), (5, 1), (9, 1)]
+    assert I2C.plan_block_reads(addresses, max_gap = 2) == [(0, 6), (9, 1)]
+    assert I2C.plan_block_reads(addresses, max_gap = 3) == [(0, 10)]
+
+
+
+def test_plan_block_reads_max_block_size():
+    assert I2C.plan_block_reads(range(10), max_block_size = 4) == [(0, 4), (4, 4), (8, 2)]
+    assert I2C.plan_block_reads([0, 3, 4], max_gap = 2, max_block_size = 4) == [(0, 4), (4, 1)]
+    assert all(n_bytes <= I2C.MAX_BLOCK_SIZE for _, n_bytes in I2C.plan_block_reads(range(100)))
+
+
+
+def test_read_registers_reads_planned_blocks():
+    bus = SimulatedI2C()
+    bus.add_device(0x40, RegistersMap('m', registers = [Register('R{}'.format(i), address = i, default_value = i,
+                                                                 elements = [Element('E{}'.format(i), 0, 8)])
+                                                        for i in range(16)]))
+    instrumentation = Instrumentation()
+    i2c = instrumentation.instrument(I2C(bus, backend = 'Virtual'), 'i2c')
+
+    assert i2c.read_registers(0x40, [1, 3, 3, 10], max_gap = 1) == {1: 1, 3: 3, 10: 10}
+    assert instrumentation.stats['buses']['i2c']['transactions'] == 2
+    assert i2c.read_registers(0x40, []) == {}
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from utilities.adapters.instrumentation import Instrumentation
+from utilities.adapters.peripherals import I2C, SPI
+from utilities.adapters.simulator import SimulatedPin
+from utilities.shift_register import ShiftRegister
+
+
+
+class SlowI2C:
+
+    def readfrom_mem(self, i2c_address, reg_address, n_bytes):
+        time.sleep(0.0005)
+        return bytes(n_bytes)
+
+
+    def writeto_mem(self, i2c_address, reg_address, buf):
+        pass
+
+
+    def writeto(self, i2c_address, buf):
+        pass
+
+
+    def readfrom(self, i2c_address, n_bytes):
+        return bytes(n_bytes)
+
+
+
+def test_nested_calls_counted_once():
+    instrumentation = Instrumentation()
+    i2c = instrumentation.instrument(I2C(SlowI2C(), backend = 'uPy'), 'i2c')
+
+    i2c.write_byte(0x40, 1)
+    i2c.read_registers(0x40, [0, 1, 2])
+
+    assert instrumentation.stats['buses']['i2c']['transactions'] == 2
+
+
+
+def test_concurrent_threads_all_counted():
+    instrumentation = Instrumentation()
+    i2c = instrumentation.instrument(I2C(SlowI2C(), backend = 'uPy'), 'i2c')
+
+
+    def work():
+        for _ in range(50):
+            i2c.read_addressed_bytes(0x40, 0, 2)
+
+
+    threads = [threading.Thread(target = work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert instrumentation.stats['buses']['i2c']['transactions'] == 200
+    assert instrumentation.stats['buses']['i2c']['bytes_read'] == 400
+
+
+
+def test_double_instrumentation_rejected():
+    instrumentation = Instrumentation()
+    i2c = instrumentation.instrument(I2C(SlowI2C(), backend = 'uPy'))
+
+    with pytest.raises(ValueError):
+        instrumentation.instrument(i2c)
+
+    instrumentation.uninstrument(i2c)
+    instrumentation.instrument(i2c)
+
+
+
+def test_shift_register_behind_spi_counted_per_call():
+    instrumentation = Instrumentation()
+    shift_register = ShiftRegister(SimulatedPin(), SimulatedPin(), SimulatedPin())
+    spi = SPI(shift_register, SimulatedPin(), backend = 'Ftdi')
+    instrumentation.instrument(shift_register, 'sr')
+
+    spi.write(b'abc')
+    spi.readinto(bytearray(2))
+
+    stats = instrumentation.stats['buses']['sr']
+    assert stats['transactions'] == 2
+    assert (stats['bytes_written'], stats['bytes_read']) == (3, 2)
@@ -0,0 +1,117 @@
+from utilities.adapters.peripherals import I2C
+from utilities.adapters.simulator import SimulatedI2C
+from utilities.register import Element, Register, RegistersMap
+from utilities.sampler import RegisterSampler
+
+
+
+class FakeClock:
+    # every reading advances a little, so the sampler's spin wait ends; sleep() jumps ahead.
+
+    def __init__(self, tick = 1e-6):
+        self.t = 0.0
+        self.tick = tick
+
+
+    def __call__(self):
+        self.t += self.tick
+        return self.t
+
+
+    def sleep(self, seconds):
+        self.t += seconds
+
+
+
+def get_registers_map():
+    return RegistersMap('m', registers = [
+        Register('STATUS', address = 0, elements = [Element('MODE', 0, 4), Element('READY', 7, 1, read_only = True)]),
+        Register('DATA', address = 1, elements = [Element('LO', 0, 8), Element('HI', 8, 8)])])
+
+
+
+def get_sampler(names = ('STATUS',), capacity = 4, clock = None):
+    rm = get_registers_map()
+    bus = SimulatedI2C()
+    device = bus.add_device(0x40, rm)
+    kwargs = {} if clock is None else {'clock': clock, 'sleep': clock.sleep}
+    sampler = RegisterSampler(rm, list(names), 100, I2C(bus, backend = 'Virtual'), 0x40, capacity = capacity,
+                              **kwargs)
+    return sampler, device, rm
+
+
+
+def test_load_latest_loads_read_only_elements():
+    sampler, device, rm = get_sampler()
+    device.set(0, b'\x85')
+
+    sampler.sample()
+    sampler.load_latest()
+
+    assert rm.elements['READY']['element'].value == 1
+    assert rm.elements['MODE']['element'].value == 5
+
+
+
+def test_values_decode_elements_and_registers():
+    sampler, device, _ = get_sampler(names = ('READY', 'MODE', 'DATA', 'HI'))
+    device.set(0, b'\x85\x12\x34')
+
+    sampler.sample()
+
+    assert sampler.frame_size == 3
+    assert sampler.values('READY') == [1]
+    assert sampler.values('MODE') == [5]
+    assert sampler.values('DATA') == [0x1234]
+    assert sampler.values('HI') == [0x12]
+
+
+
+def test_ring_buffer_keeps_latest_in_order():
+    sampler, device, _ = get_sampler(capacity = 4)
+
+    for i in range(6):
+        device.set(0, bytes([i]))
+        sampler.sample(timestamp = float(i))
+
+    assert sampler.n_buffered == 4
+    assert sampler.values('STATUS') == [2, 3, 4, 5]
+    assert sampler.timestamps() == [2.0, 3.0, 4.0, 5.0]
+    assert sampler.stats['overwritten'] == 2
+
+
+
+def test_run_does_not_drift():
+    clock = FakeClock()
+    sampler, _, _ = get_sampler(capacity = 64, clock = clock)
+
+    assert sampler.run(n_samples = 50) == 50
+
+    timestamps = sampler.timestamps()
+    for k, timestamp in enumerate(timestamps):
+        assert abs(timestamp - timestamps[0] - k * sampler.period) < 1e-3
+    assert sampler.n_overruns == 0
+    assert sampler.max_jitter < 1e-3
+
+
+
+def test_run_counts_overruns_and_skips_missed_slots():
+    clock = FakeClock()
+    sampler, _, _ = get_sampler(capacity = 64, clock = clock)
+    read = sampler.i2c.read_addressed_into
+
+
+    def slow_read(i2c_address, reg_address, buf):
+        if sampler.n_samples == 3:
+            clock.sleep(3.5 * sampler.period)
+        return read(i2c_address, reg_address, buf)
+
+
+    sampler.i2c.read_addressed_into = slow_read
+    sampler.run(n_samples = 10)
+
+    assert sampler.n_bus_overruns == 1
+    assert sampler.n_overruns == 2
+
+    timestamps = sampler.timestamps()
+    assert abs(timestamps[-1] - timestamps[0] - 11 * sampler.period) < 1e-3
@@ -0,0 +1,108 @@
+import pytest
+
+from utilities.adapters.peripherals import I2C
+from utilities.adapters.scheduler import PRIORITY_BULK, PRIORITY_CONTROL, BusScheduler
+
+
+
+class LoggingI2C:
+
+    def __init__(self):
+        self.log = []
+        self.memory = bytearray(256)
+
+
+    def readfrom_mem(self, i2c_address, reg_address, n_bytes):
+        self.log.append(('r', reg_address, n_bytes))
+        return bytes(self.memory[reg_address:reg_address + n_bytes])
+
+
+    def writeto_mem(self, i2c_address, reg_address, buf):
+        self.log.append(('w', reg_address, bytes(buf)))
+        self.memory[reg_address:reg_address + len(buf)] = buf
+
+
+    def writeto(self, i2c_address, buf):
+        pass
+
+
+    def readfrom(self, i2c_address, n_bytes):
+        return bytes(n_bytes)
+
+
+
+def get_scheduler():
+    bus = LoggingI2C()
+    return BusScheduler(I2C(bus, backend = 'uPy')), bus
+
+
+
+def test_contiguous_writes_are_merged():
+    scheduler, bus = get_scheduler()
+    writes = [scheduler.submit_write(0x40, reg_address, [reg_address]) for reg_address in (3, 1, 2)]
+
+    scheduler.run_pending()
+
+    assert bus.log == [('w', 1, b'\x01\x02\x03')]
+    assert [w.wait(0) for w in writes] == [1, 1, 1]
+
+
+
+def test_write_does_not_overtake_earlier_read():
+    scheduler, bus = get_scheduler()
+    scheduler.submit_write(0x40, 0x10, b'\x01')
+    read = scheduler.submit_read(0x40, 0x11, 1)
+    scheduler.submit_write(0x40, 0x11, b'\x02')
+
+    scheduler.run_pending()
+
+    assert bus.log == [('w', 0x10, b'\x01'), ('r', 0x11, 1), ('w', 0x11, b'\x02')]
+    assert read.wait(0) == b'\x00'
+
+
+
+def test_write_does_not_overtake_earlier_call():
+    scheduler, bus = get_scheduler()
+    scheduler.submit_write(0x40, 0x10, b'\x01')
+    scheduler.submit(bus.log.append, 'call')
+    scheduler.submit_write(0x40, 0x11, b'\x02')
+
+    scheduler.run_pending()
+
+    assert bus.log == [('w', 0x10, b'\x01'), 'call', ('w', 0x11, b'\x02')]
+
+
+
+def test_wait_times_out():
+    scheduler, _ = get_scheduler()
+    write = scheduler.submit_write(0x40, 0, b'\x01')
+
+    with pytest.raises(TimeoutError):
+        write.wait(0.01)
+
+
+
+def test_control_write_does_not_overtake_bulk_write_to_same_register():
+    scheduler, bus = get_scheduler()
+    bulk = scheduler.submit_write(0x40, 0x10, b'\x01', priority = PRIORITY_BULK)
+    scheduler.submit_write(0x40, 0x20, b'\x05', priority = PRIORITY_BULK)
+    scheduler.submit_write(0x40, 0x10, b'\x02', priority = PRIORITY_CONTROL)
+
+    scheduler.run_pending()
+
+    assert bus.log[:2] == [('w', 0x10, b'\x01'), ('w', 0x10, b'\x02')]
+    assert bus.memory[0x10] == 0x02
+    assert bulk.priority == PRIORITY_CONTROL
+
+
+
+def test_control_read_does_not_overtake_bulk_write_to_same_register():
+    scheduler, bus = get_scheduler()
+    scheduler.submit_write(0x40, 0x10, b'\x07', priority = PRIORITY_BULK)
+    read = scheduler.submit_read(0x40, 0x10, 1, priority = PRIORITY_CONTROL)
+    scheduler.submit_read(0x40, 0x30, 1, priority = PRIORITY_CONTROL)
+
+    scheduler.run_pending()
+
+    assert bus.log == [('w', 0x10, b'\x07'), ('r', 0x10, 1), ('r', 0x30, 1)]
+    assert read.wait(0) == b'\x07'
@@ -0,0 +1,70 @@
+from utilities.adapters.peripherals import SPI
+from utilities.shift_register import ShiftRegister
+
+
+
+class Pin:
+
+    def __init__(self, bits = ()):
+        self.bits = list(bits)
+        self.levels = []
+
+
+    def high(self):
+        self.levels.append(1)
+
+
+    def low(self):
+        self.levels.append(0)
+
+
+    def value(self):
+        return self.bits.pop(0)
+
+
+
+def test_shift_in_msb_first():
+    shift_register = ShiftRegister(Pin(), Pin(), Pin([1, 0, 1, 0, 0, 1, 0, 1]))
+    assert shift_register.shiftIn() == 0xA5
+
+
+
+def test_shift_in_lsb_first():
+    shift_register = ShiftRegister(Pin(), Pin(), Pin([1, 0, 1, 0, 0, 1, 0, 1]), lsbfirst = True)
+    assert shift_register.shiftIn() == 0xA5
+
+
+
+def test_spi_readinto_on_shift_register():
+    shift_register = ShiftRegister(Pin(), Pin(), Pin([1] * 8 + [0, 0, 0, 0, 0, 0, 0, 1]))
+    spi = SPI(shift_register, Pin(), backend = 'Ftdi')
+    buf = bytearray(2)
+
+    spi.readinto(buf)
+
+    assert buf == b'\xff\x01'
+
+
+
+class Group:
+
+    def __init__(self):
+        self.writes = []
+
+
+    def write(self, values):
+        self.writes.append(tuple(values))
+
+
+
+def test_grouped_shift_out_keeps_stb_without_drop_stb():
+    group = Group()
+    shift_register = ShiftRegister(Pin(), Pin(), Pin(), pin_group = group)
+
+    shift_register.shiftOut(0xA5, drop_stb = False, raise_stb = False)
+    assert {stb for _, _, stb in group.writes} == {1}
+
+    group.writes = []
+    shift_register.shiftOut(0xA5)
+    assert {stb for _, _, stb in group.writes} == {0}
+    assert shift_register.stb_pin.levels == [1]
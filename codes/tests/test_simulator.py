@@ -0,0 +1,86 @@
+import gc
+import weakref
+
+import pytest
+
+from utilities.adapters.peripherals import I2C, SPI, Pin, PinGroup
+from utilities.adapters.simulator import SimulatedDevice
+from utilities.register import Element, Register, RegistersMap
+
+
+
+def get_registers_map():
+    return RegistersMap('sim', registers = [
+        Register('CTRL', address = 0, default_value = 0x81,
+                 elements = [Element('en', 0, 1), Element('mode', 1, 3), Element('id', 7, 1, read_only = True)]),
+        Register('DATA', address = 1, default_value = 0x1234, elements = [Element('lo', 0, 8), Element('hi', 8, 8)])])
+
+
+
+def test_virtual_factories():
+    pin = Pin.get_pin(5, backend = 'Virtual')
+    pin.high()
+    assert pin.value() == 1
+
+    group = PinGroup.get_pin_group([1, 2], backend = 'Virtual')
+    group.write([0, 1])
+    assert [p.value() for p in group.pins] == [0, 1]
+
+    assert I2C.get_i2c(backend = 'Virtual').scan() == []
+    assert SPI.get_spi(backend = 'Virtual', registers_map = get_registers_map()).device.size == 3
+
+
+
+def test_i2c_device_defaults_burst_and_read_only():
+    bus = I2C.get_i2c(backend = 'Virtual')
+    bus.add_device(0x40, get_registers_map())
+    i2c = I2C(bus, backend = 'Virtual')
+
+    assert bytes(i2c.read_addressed_bytes(0x40, 0, 3)) == b'\x81\x12\x34'
+
+    i2c.write_addressed_bytes(0x40, 0, b'\x00\xab\xcd')
+    assert bytes(i2c.read_addressed_bytes(0x40, 0, 3)) == b'\x80\xab\xcd'
+
+    with pytest.raises(OSError):
+        i2c.read_addressed_byte(0x41, 0)
+
+
+
+def test_spi_device_frames():
+    sim = SPI.get_spi(backend = 'Virtual', registers_map = get_registers_map())
+    spi = SPI(sim, sim.ss_pin, backend = 'Virtual')
+    buf = bytearray(3)
+
+    spi.write(b'\x01\x11\x22')
+    spi.write_readinto(b'\x81\x00\x00', buf)
+
+    assert buf == b'\x00\x11\x22'
+
+
+
+def test_layout_cache_follows_registers_and_releases_maps():
+    rm = get_registers_map()
+    assert SimulatedDevice(rm).size == 3
+
+    rm.registers = [Register('WIDE', address = 4, elements = [Element('w', 0, 8, read_only = True)])]
+    device = SimulatedDevice(rm)
+    device.write(b'\xff', 4)
+    assert device.size == 5 and device.memory[4] == 0
+
+    ref = weakref.ref(rm)
+    del rm, device
+    gc.collect()
+    assert ref() is None
+
+
+
+def test_device_set_wraps_around():
+    bus = I2C.get_i2c(backend = 'Virtual')
+    device = bus.add_device(0x40, get_registers_map())
+    i2c = I2C(bus, backend = 'Virtual')
+
+    device.set(2, b'\x01\x02')
+    assert device.size == 3 and bytes(device.memory) == b'\x02\x12\x01'
+
+    i2c.write_addressed_bytes(0x40, 2, b'\x05')
+    assert device.memory[2] == 0x05
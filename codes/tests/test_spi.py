@@ -0,0 +1,75 @@
+from utilities.adapters.peripherals import SPI
+
+
+
+class Pin:
+
+    def high(self):
+        pass
+
+
+    def low(self):
+        pass
+
+
+
+class SpiDev:
+    # spidev without writebytes2 / xfer3, as in older releases.
+
+    def __init__(self):
+        self.written = []
+
+
+    def writebytes(self, values):
+        assert isinstance(values, list)
+        self.written.append(values)
+
+
+    def readbytes(self, n_bytes):
+        return [0xAA] * n_bytes
+
+
+    def xfer2(self, values):
+        assert isinstance(values, list)
+        return values
+
+
+
+def get_spi():
+    spi = SPI(SpiDev(), Pin(), backend = 'RPi')
+    spi.MAX_CHUNK_SIZE = 4
+    return spi
+
+
+
+def test_rpi_write_accepts_lists_and_buffers():
+    spi = get_spi()
+
+    spi.write([1, 2, 3, 4, 5])
+    spi.write(bytearray(b'\x06\x07'))
+
+    assert spi._bus.written == [[1, 2, 3, 4], [5], [6, 7]]
+
+
+
+def test_rpi_write_readinto_chunks():
+    spi = get_spi()
+    read_buf = bytearray(6)
+
+    spi.write_readinto([1, 2, 3, 4, 5, 6], read_buf)
+
+    assert read_buf == bytes([1, 2, 3, 4, 5, 6])
+
+
+
+def test_transaction_holds_chip_select():
+    spi = get_spi()
+    buf = bytearray(2)
+
+    with spi.transaction():
+        spi.write([1])
+        spi.readinto(buf)
+        assert spi._depth == 1
+
+    assert spi._depth == 0
+    assert buf == b'\xaa\xaa'
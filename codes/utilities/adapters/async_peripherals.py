@@ -0,0 +1,248 @@
+import asyncio
+import itertools
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+class _LoopState:
+    # asyncio locks belong to one event loop, so every loop using a bus gets its own lock to queue its tasks;
+    # the bus-wide threading lock in _BusContext then orders the loops.
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.owner = None
+        self.depth = 0
+
+
+
+class _BusContext:
+    # One per physical bus: a single worker thread runs its blocking I/O, and a lock keeps
+    # multi-step transactions atomic, across event loops too. Different buses get different workers, so they overlap.
+    POLL_INTERVAL = 0.0005
+    # A context lives while AsyncBus objects use it: the last close() shuts its worker down.
+
+    def __init__(self, key, physical_bus, name):
+        self.key = key
+        self.physical_bus = physical_bus
+        self.executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = name)
+        self.n_users = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self._loop_states = weakref.WeakKeyDictionary()
+
+
+    def loop_state(self):
+        loop = asyncio.get_running_loop()
+        state = self._loop_states.get(loop)
+
+        if state is None:
+            state = self._loop_states[loop] = _LoopState()
+
+        return state
+
+
+    async def acquire(self):
+        # polled, so the event loop keeps running and a cancelled waiter never ends up holding the lock.
+        while not self.lock.acquire(blocking = False):
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+
+    def shutdown(self):
+        self.closed = True
+        self.executor.shutdown(wait = True)
+
+
+
+_contexts = {}
+_names = itertools.count()
+
+
+
+def _acquire_context(bus):
+    # virtual devices have no physical bus, each is a bus of its own.
+    physical_bus = bus if bus.is_virtual_device else bus._bus
+    key = id(physical_bus)
+
+    if key not in _contexts:
+        _contexts[key] = _BusContext(key, physical_bus, name = 'bus_{}'.format(next(_names)))
+
+    context = _contexts[key]
+    context.n_users += 1
+    return context
+
+
+
+def _release_context(context):
+    context.n_users -= 1
+
+    if context.n_users <= 0 and not context.closed:
+        _contexts.pop(context.key, None)
+        context.shutdown()
+
+
+
+def shutdown():
+    # stops every bus worker; AsyncBus objects created before can not be used afterwards.
+    while _contexts:
+        _contexts.popitem()[1].shutdown()
+
+
+
+class _Transaction:
+
+    def __init__(self, context):
+        self._context = context
+
+
+    async def __aenter__(self):
+        state = self._context.loop_state()
+        task = asyncio.current_task()
+
+        if state.owner is not task:
+            await state.lock.acquire()
+            try:
+                await self._context.acquire()
+            except BaseException:
+                state.lock.release()
+                raise
+            state.owner = task
+        state.depth += 1
+
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        state = self._context.loop_state()
+        state.depth -= 1
+
+        if state.depth == 0:
+            state.owner = None
+            self._context.lock.release()
+            state.lock.release()
+
+
+
+class AsyncBus:
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._context = _acquire_context(bus)
+
+
+    def close(self):
+        if self._context is not None:
+            _release_context(self._context)
+            self._context = None
+
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _get_context(self):
+        if self._context is None or self._context.closed:
+            raise RuntimeError('{} is closed.'.format(type(self).__name__))
+        return self._context
+
+
+    @property
+    def is_virtual_device(self):
+        return self.bus.is_virtual_device
+
+
+    def transaction(self):
+        # async with bus.transaction(): ...  holds the bus across several awaited calls.
+        return _Transaction(self._get_context())
+
+
+    async def run(self, func, *args):
+        context = self._get_context()
+
+        async with _Transaction(context):
+            return await asyncio.get_running_loop().run_in_executor(context.executor, func, *args)
+
+
+    async def atomic(self, func, *args):
+        # run func(bus, *args) in the worker thread, for sequences that must not be interleaved.
+        return await self.run(func, self.bus, *args)
+
+
+    async def write(self, bytes_array):
+        return await self.run(self.bus.write, bytes_array)
+
+
+    async def read(self, n_bytes):
+        return await self.run(self.bus.read, n_bytes)
+
+
+    async def readinto(self, buf):
+        return await self.run(self.bus.readinto, buf)
+
+
+
+class AsyncSPI(AsyncBus):
+
+    async def write_readinto(self, write_buf, read_buf):
+        return await self.run(self.bus.write_readinto, write_buf, read_buf)
+
+
+
+class AsyncI2C(AsyncBus):
+
+    async def read_bytes(self, i2c_address, n_bytes):
+        return await self.run(self.bus.read_bytes, i2c_address, n_bytes)
+
+
+    async def read_byte(self, i2c_address):
+        return await self.run(self.bus.read_byte, i2c_address)
+
+
+    async def readinto(self, i2c_address, buf):
+        return await self.run(self.bus.readinto, i2c_address, buf)
+
+
+    async def read_addressed_bytes(self, i2c_address, reg_address, n_bytes):
+        return await self.run(self.bus.read_addressed_bytes, i2c_address, reg_address, n_bytes)
+
+
+    async def read_addressed_into(self, i2c_address, reg_address, buf):
+        return await self.run(self.bus.read_addressed_into, i2c_address, reg_address, buf)
+
+
+    async def read_addressed_byte(self, i2c_address, reg_address):
+        return await self.run(self.bus.read_addressed_byte, i2c_address, reg_address)
+
+
+    async def read_registers(self, i2c_address, reg_addresses, max_gap = 0, max_block_size = None):
+        max_block_size = max_block_size or self.bus.MAX_BLOCK_SIZE
+        return await self.run(self.bus.read_registers, i2c_address, reg_addresses, max_gap, max_block_size)
+
+
+    async def write_bytes(self, i2c_address, bytes_array):
+        return await self.run(self.bus.write_bytes, i2c_address, bytes_array)
+
+
+    async def write_byte(self, i2c_address, value):
+        return await self.run(self.bus.write_byte, i2c_address, value)
+
+
+    async def write_vectored(self, i2c_address, buffers):
+        return await self.run(self.bus.write_vectored, i2c_address, buffers)
+
+
+    async def write_addressed_from(self, i2c_address, reg_address, buf):
+        return await self.run(self.bus.write_addressed_from, i2c_address, reg_address, buf)
+
+
+    async def write_addressed_bytes(self, i2c_address, reg_address, bytes_array):
+        return await self.run(self.bus.write_addressed_bytes, i2c_address, reg_address, bytes_array)
+
+
+    async def write_addressed_byte(self, i2c_address, reg_address, value):
+        return await self.run(self.bus.write_addressed_byte, i2c_address, reg_address, value)
@@ -0,0 +1,448 @@
+# One process owns a physical bus and serves its transactions to other processes over a Unix-domain socket.
+#
+# Frames are little endian:
+#   request  = request_id (H), op (B), i2c_address (B), reg_address (B), length (I), payload (length bytes, writes only)
+#   response = request_id (H), status (B), length (I), payload (length bytes: data read, or an error message)
+# For reads, length is the number of bytes to read and the request carries no payload.
+# Clients may send many requests without waiting; the broker executes every complete request it has
+# received from all clients as one batch per cycle, then answers each client in order.
+# OP_SPI_BEGIN / OP_SPI_END hold chip select across requests of one client; meanwhile requests of
+# other clients are deferred until the frame ends.
+
+import os
+import selectors
+import socket
+import stat
+import struct
+import threading
+
+try:
+    from utilities.adapters.peripherals import I2C, SPI, _copy_into
+except ImportError:
+    from peripherals import I2C, SPI, _copy_into
+
+
+REQUEST = struct.Struct('<HBBBI')
+RESPONSE = struct.Struct('<HBI')
+
+OP_READ_BYTES = 1
+OP_READ_ADDRESSED_BYTES = 2
+OP_WRITE_BYTES = 3
+OP_WRITE_ADDRESSED_BYTES = 4
+OP_SPI_WRITE = 5
+OP_SPI_READ = 6
+OP_SPI_WRITE_READ = 7
+OP_SPI_BEGIN = 8
+OP_SPI_END = 9
+READ_OPS = (OP_READ_BYTES, OP_READ_ADDRESSED_BYTES, OP_SPI_READ)
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+
+
+class BusBroker:
+
+    def __init__(self, bus, path):
+        self.bus = bus
+        self.path = path
+
+        self.n_cycles = 0
+        self.n_requests = 0
+
+        self._selector = selectors.DefaultSelector()
+        self._server = None
+        self._buffers = {}
+        self._deferred = []
+        self._frame = None
+        self._frame_owner = None
+        self._running = False
+        self._thread = None
+
+
+    def _execute(self, op, i2c_address, reg_address, length, payload):
+        bus = self.bus
+
+        if op == OP_READ_BYTES:
+            return bytes(bus.read_bytes(i2c_address, length))
+        if op == OP_READ_ADDRESSED_BYTES:
+            return bytes(bus.read_addressed_bytes(i2c_address, reg_address, length))
+        if op == OP_WRITE_BYTES:
+            bus.write_bytes(i2c_address, payload)
+            return b''
+        if op == OP_WRITE_ADDRESSED_BYTES:
+            bus.write_addressed_bytes(i2c_address, reg_address, payload)
+            return b''
+        if op == OP_SPI_WRITE:
+            bus.write(payload)
+            return b''
+        if op == OP_SPI_READ:
+            buf = bytearray(length)
+            bus.readinto(buf)
+            return bytes(buf)
+        if op == OP_SPI_WRITE_READ:
+            buf = bytearray(len(payload))
+            bus.write_readinto(payload, buf)
+            return bytes(buf)
+
+        raise ValueError('Unknown op {}.'.format(op))
+
+
+    def _begin_frame(self, conn):
+        if self._frame is not None:
+            raise OSError('A frame is already open.')
+
+        frame = self.bus.transaction()
+        frame.__enter__()
+        self._frame, self._frame_owner = frame, conn
+
+
+    def _end_frame(self):
+        frame, self._frame, self._frame_owner = self._frame, None, None
+        if frame is not None:
+            frame.__exit__(None, None, None)
+
+
+    def _parse(self, conn):
+        # split complete frames off the front of the connection buffer.
+        buf = self._buffers[conn]
+        requests = []
+        offset = 0
+
+        while len(buf) - offset >= REQUEST.size:
+            request_id, op, i2c_address, reg_address, length = REQUEST.unpack_from(buf, offset)
+            payload_size = 0 if op in READ_OPS else length
+
+            if len(buf) - offset - REQUEST.size < payload_size:
+                break
+
+            start = offset + REQUEST.size
+            requests.append((conn, request_id, op, i2c_address, reg_address, length,
+                             bytes(buf[start:start + payload_size])))
+            offset = start + payload_size
+
+        del buf[:offset]
+        return requests
+
+
+    def _accept(self):
+        conn, _ = self._server.accept()
+        self._buffers[conn] = bytearray()
+        self._selector.register(conn, selectors.EVENT_READ)
+
+
+    def _close(self, conn):
+        if conn is self._frame_owner:
+            self._end_frame()
+        self._deferred = [request for request in self._deferred if request[0] is not conn]
+
+        self._selector.unregister(conn)
+        del self._buffers[conn]
+        conn.close()
+
+
+    def run_cycle(self, timeout = 0.1):
+        batch, self._deferred = self._deferred, []
+
+        for key, _ in self._selector.select(0 if batch and self._frame_owner is None else timeout):
+            if key.fileobj is self._server:
+                self._accept()
+                continue
+
+            data = key.fileobj.recv(65536)
+            if not data:
+                self._close(key.fileobj)
+                continue
+
+            self._buffers[key.fileobj].extend(data)
+            batch.extend(self._parse(key.fileobj))
+
+        batch = [request for request in batch if request[0] in self._buffers]  # drop closed clients
+        responses = {}
+        waiting = set()
+        n_executed = 0
+
+        for request in batch:
+            conn, request_id, op, i2c_address, reg_address, length, payload = request
+
+            # while another client holds a frame, keep this client's requests, in order, for a later cycle.
+            if conn in waiting or (self._frame_owner is not None and conn is not self._frame_owner):
+                self._deferred.append(request)
+                waiting.add(conn)
+                continue
+
+            try:
+                if op == OP_SPI_BEGIN:
+                    self._begin_frame(conn)
+                    data = b''
+                elif op == OP_SPI_END:
+                    self._end_frame()
+                    data = b''
+                else:
+                    data = self._execute(op, i2c_address, reg_address, length, payload)
+                status = STATUS_OK
+            except Exception as e:
+                data, status = str(e).encode(), STATUS_ERROR
+
+            responses.setdefault(conn, []).append(RESPONSE.pack(request_id, status, len(data)) + data)
+            n_executed += 1
+
+        if not n_executed:
+            return 0
+
+        for conn, frames in responses.items():
+            try:
+                conn.sendall(b''.join(frames))
+            except OSError:
+                self._close(conn)
+
+        self.n_cycles += 1
+        self.n_requests += n_executed
+        return n_executed
+
+
+    def _remove_socket_file(self):
+        # only a socket left behind is removed, never a regular file at that path.
+        try:
+            if stat.S_ISSOCK(os.stat(self.path).st_mode):
+                os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+    def open(self):
+        self._remove_socket_file()
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        self._selector.register(self._server, selectors.EVENT_READ)
+
+
+    def close(self):
+        for conn in list(self._buffers):
+            self._close(conn)
+
+        if self._server is not None:
+            self._selector.unregister(self._server)
+            self._server.close()
+            self._server = None
+            self._remove_socket_file()
+
+
+    def serve_forever(self):
+        self._running = True
+        while self._running:
+            self.run_cycle()
+
+
+    def start(self):
+        self.open()
+        self._thread = threading.Thread(target = self.serve_forever, daemon = True)
+        self._thread.start()
+        return self
+
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.close()
+
+
+
+class _BrokerConnection:
+    MAX_PENDING = 256  # answers are collected at least this often, so neither side blocks on a full socket.
+
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self._request_id = 0
+        self._pending = []
+        self._buffer = bytearray()
+        self.pipelining = 0
+
+
+    def send(self, op, i2c_address = 0, reg_address = 0, length = 0, payload = b''):
+        self._request_id = (self._request_id + 1) & 0xFFFF
+        self.socket.sendall(REQUEST.pack(self._request_id, op, i2c_address, reg_address, length) + bytes(payload))
+        self._pending.append(self._request_id)
+
+
+    def _receive_one(self):
+        while True:
+            if len(self._buffer) >= RESPONSE.size:
+                request_id, status, length = RESPONSE.unpack_from(self._buffer)
+                if len(self._buffer) >= RESPONSE.size + length:
+                    data = bytes(self._buffer[RESPONSE.size:RESPONSE.size + length])
+                    del self._buffer[:RESPONSE.size + length]
+                    assert request_id == self._pending.pop(0), 'Response out of order.'
+                    return status, data
+
+            data = self.socket.recv(65536)
+            if not data:
+                raise ConnectionError('Broker closed the connection.')
+            self._buffer.extend(data)
+
+
+    def receive_all(self):
+        # answers in request order; the first error is raised once all answers are in.
+        results = []
+        error = None
+
+        while self._pending:
+            status, data = self._receive_one()
+            if status != STATUS_OK and error is None:
+                error = OSError(data.decode())
+            results.append(data)
+
+        if error is not None:
+            raise error
+        return results
+
+
+    def call(self, op, i2c_address = 0, reg_address = 0, length = 0, payload = b''):
+        self.send(op, i2c_address, reg_address, length, payload)
+        return self.receive_all()[-1]
+
+
+    def write(self, op, i2c_address = 0, reg_address = 0, payload = b''):
+        # inside pipelined(), writes are not waited for until the next read or the end of the block.
+        self.send(op, i2c_address, reg_address, len(payload), payload)
+        if not self.pipelining or len(self._pending) >= self.MAX_PENDING:
+            self.receive_all()
+
+
+    def close(self):
+        self.socket.close()
+
+
+
+class _Pipelined:
+
+    def __init__(self, connection):
+        self._connection = connection
+
+
+    def __enter__(self):
+        self._connection.pipelining += 1
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._connection.pipelining -= 1
+        if not self._connection.pipelining:
+            self._connection.receive_all()
+
+
+
+class BrokerI2C(I2C):
+
+    def __init__(self, path):
+        super().__init__(i2c = _BrokerConnection(path))
+
+
+    def init(self):
+        connection = self._bus
+
+        self._read_bytes = \
+            lambda i2c_address, n_bytes: connection.call(OP_READ_BYTES, i2c_address, 0, n_bytes)
+        self._read_addressed_bytes = \
+            lambda i2c_address, reg_address, n_bytes: connection.call(OP_READ_ADDRESSED_BYTES, i2c_address,
+                                                                      reg_address, n_bytes)
+        self._read_addressed_byte = \
+            lambda i2c_address, reg_address: self._read_addressed_bytes(i2c_address, reg_address, 1)[0]
+        self._readinto = \
+            lambda i2c_address, buf: _copy_into(buf, self._read_bytes(i2c_address, len(buf)))
+        self._read_addressed_into = \
+            lambda i2c_address, reg_address, buf: _copy_into(buf, self._read_addressed_bytes(i2c_address,
+                                                                                              reg_address, len(buf)))
+
+        self._write_bytes = \
+            lambda i2c_address, bytes_array: connection.write(OP_WRITE_BYTES, i2c_address, 0, bytes_array)
+        self._write_addressed_from = \
+            lambda i2c_address, reg_address, buf: connection.write(OP_WRITE_ADDRESSED_BYTES, i2c_address,
+                                                                   reg_address, buf)
+        self._write_addressed_byte = \
+            lambda i2c_address, reg_address, value: self._write_addressed_from(i2c_address, reg_address,
+                                                                               bytes([value]))
+        self._write_vectored = \
+            lambda i2c_address, buffers: self._write_bytes(i2c_address, b''.join(bytes(buf) for buf in buffers))
+
+
+    def pipelined(self):
+        # with i2c.pipelined(): ...  writes are sent without waiting for their answers.
+        return _Pipelined(self._bus)
+
+
+    def read_registers(self, i2c_address, reg_addresses, max_gap = 0, max_block_size = I2C.MAX_BLOCK_SIZE):
+        # all block reads are sent at once, so the broker runs them in one cycle.
+        reg_addresses = set(reg_addresses)
+        blocks = self.plan_block_reads(reg_addresses, max_gap, max_block_size)
+
+        for start, n_bytes in blocks:
+            self._bus.send(OP_READ_ADDRESSED_BYTES, i2c_address, start, n_bytes)
+
+        values = {}
+        for (start, n_bytes), bytes_array in zip(blocks, self._bus.receive_all()[-len(blocks):]):
+            for i in range(n_bytes):
+                if start + i in reg_addresses:
+                    values[start + i] = bytes_array[i]
+
+        return values
+
+
+    def close(self):
+        self._bus.close()
+
+
+
+class BrokerSPI(SPI):
+    # the broker drives chip select around each call; transaction() holds it across calls, see OP_SPI_BEGIN.
+
+    def __init__(self, path):
+        super().__init__(spi = _BrokerConnection(path), ss = None)
+
+
+    def init(self):
+        connection = self._bus
+
+        self._write = lambda bytes_array: connection.write(OP_SPI_WRITE, payload = bytes_array)
+        self._readinto = lambda buf: _copy_into(buf, connection.call(OP_SPI_READ, length = len(buf)))
+        self._write_readinto = \
+            lambda write_buf, read_buf: _copy_into(read_buf, connection.call(OP_SPI_WRITE_READ,
+                                                                             length = len(write_buf),
+                                                                             payload = write_buf))
+
+
+    def _select(self):
+        self._bus.write(OP_SPI_BEGIN)
+
+
+    def _deselect(self):
+        self._bus.write(OP_SPI_END)
+
+
+    def write(self, bytes_array):
+        # no frame of its own, the broker selects the device for each request.
+        self._write(bytes_array)
+
+
+    def readinto(self, buf):
+        self._readinto(buf)
+        return len(buf)
+
+
+    def write_readinto(self, write_buf, read_buf):
+        assert len(write_buf) == len(read_buf), 'write_buf and read_buf need the same length.'
+
+        self._write_readinto(write_buf, read_buf)
+        return len(read_buf)
+
+
+    def pipelined(self):
+        return _Pipelined(self._bus)
+
+
+    def close(self):
+        self._bus.close()
@@ -0,0 +1,234 @@
+import threading
+import time
+
+
+READ = 'read'
+WRITE = 'write'
+TRANSFER = 'transfer'
+
+
+
+def _length(x):
+    return len(x)
+
+
+
+def _one(_):
+    return 1
+
+
+
+def _total_length(buffers):
+    return sum(len(buf) for buf in buffers)
+
+
+
+def _same(n_bytes):
+    return n_bytes
+
+
+
+# method name: (op, device address arg, register address arg, size arg, size function)
+I2C_METHODS = {'read_bytes'          : (READ, 'i2c_address', None, 'n_bytes', _same),
+               'readinto'            : (READ, 'i2c_address', None, 'buf', _length),
+               'read_addressed_bytes': (READ, 'i2c_address', 'reg_address', 'n_bytes', _same),
+               'read_addressed_into' : (READ, 'i2c_address', 'reg_address', 'buf', _length),
+               'read_addressed_byte' : (READ, 'i2c_address', 'reg_address', None, _one),
+               'write_bytes'         : (WRITE, 'i2c_address', None, 'bytes_array', _length),
+               'write_vectored'      : (WRITE, 'i2c_address', None, 'buffers', _total_length),
+               'write_addressed_from': (WRITE, 'i2c_address', 'reg_address', 'buf', _length),
+               'write_addressed_byte': (WRITE, 'i2c_address', 'reg_address', None, _one)}
+
+SPI_METHODS = {'write'         : (WRITE, None, None, 'bytes_array', _length),
+               'readinto'      : (READ, None, None, 'buf', _length),
+               'write_readinto': (TRANSFER, None, None, 'read_buf', _length)}
+
+SHIFT_REGISTER_METHODS = {'write'   : (WRITE, None, None, 'bytes_array', _length),
+                          'shiftOut': (WRITE, None, None, None, _one),
+                          'shiftIn' : (READ, None, None, None, _one),
+                          'readinto': (READ, None, None, 'buf', _length)}
+
+
+
+def _methods_of(bus):
+    if hasattr(bus, 'read_addressed_bytes'):
+        return I2C_METHODS
+    if hasattr(bus, 'shiftOut'):
+        return SHIFT_REGISTER_METHODS
+    return SPI_METHODS
+
+
+
+class _Counters:
+
+    def __init__(self, n_bins):
+        self.transactions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.time = 0.0
+        self.histogram = [0] * n_bins
+
+
+    def as_dict(self, bins):
+        return {'transactions'     : self.transactions,
+                'bytes_read'       : self.bytes_read,
+                'bytes_written'    : self.bytes_written,
+                'time'             : self.time,
+                'latency_histogram': list(zip(bins, self.histogram))}
+
+
+
+class Instrumentation:
+    # Opt-in: instrument(bus) shadows the bus methods on that one instance with timed wrappers,
+    # uninstrument(bus) removes them again, so buses that are not instrumented pay nothing.
+    # A call nested inside an instrumented call of the same thread (e.g. write_byte -> write_bytes) is counted once.
+    LATENCY_BINS = (10e-6, 100e-6, 1e-3, 10e-3, 100e-3, float('inf'))
+
+
+    def __init__(self, trace = False, max_trace_length = 100000, clock = time.perf_counter):
+        self.trace = trace
+        self.max_trace_length = max_trace_length
+        self.clock = clock
+        self.hooks = []
+        self._names = {}
+        self._lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        self.per_bus = {}
+        self.per_device = {}
+        self.events = []
+
+
+    def add_hook(self, hook):
+        # hook(bus, device_address, register_address, op, n_bytes, duration)
+        self.hooks.append(hook)
+
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+
+    @staticmethod
+    def is_instrumented(bus):
+        return any(getattr(attr, '_instrumented', False) for attr in vars(bus).values())
+
+
+    def instrument(self, bus, name = None, methods = None):
+        if self.is_instrumented(bus):
+            raise ValueError('{} is already instrumented, uninstrument it first.'.format(bus))
+
+        methods = methods or _methods_of(bus)
+        self._names[id(bus)] = name or '{}_{}'.format(type(bus).__name__, len(self._names))
+        local = threading.local()  # nesting depth, per thread
+
+        for method_name, spec in methods.items():
+            if hasattr(bus, method_name):
+                setattr(bus, method_name, self._wrap(bus, getattr(bus, method_name), spec, local))
+
+        return bus
+
+
+    def uninstrument(self, bus):
+        for method_name in list(vars(bus)):
+            if getattr(vars(bus)[method_name], '_instrumented', False):
+                delattr(bus, method_name)
+
+        return bus
+
+
+    def _wrap(self, bus, method, spec, local):
+        op, device_arg, register_arg, size_arg, size = spec
+        code = method.__func__.__code__
+        params = code.co_varnames[1:code.co_argcount]
+        clock = self.clock
+
+
+        def get_arg(args, kwargs, name):
+            if name is None:
+                return None
+            if name in kwargs:
+                return kwargs[name]
+            i = params.index(name)
+            return args[i] if i < len(args) else None
+
+
+        def wrapper(*args, **kwargs):
+            if getattr(local, 'depth', 0):
+                return method(*args, **kwargs)
+
+            local.depth = 1
+            t0 = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                duration = clock() - t0
+                local.depth = 0
+                self.record(bus, get_arg(args, kwargs, device_arg), get_arg(args, kwargs, register_arg), op,
+                            size(get_arg(args, kwargs, size_arg)), duration, t0)
+
+
+        wrapper._instrumented = True
+        return wrapper
+
+
+    def _bin(self, duration):
+        for i, edge in enumerate(self.LATENCY_BINS):
+            if duration < edge:
+                return i
+
+
+    def record(self, bus, device_address, register_address, op, n_bytes, duration, timestamp = None):
+        name = self._names.get(id(bus), type(bus).__name__)
+        i_bin = self._bin(duration)
+
+        with self._lock:
+            self._count(name, device_address, register_address, op, n_bytes, duration, timestamp, i_bin)
+
+        for hook in self.hooks:
+            hook(bus, device_address, register_address, op, n_bytes, duration)
+
+
+    def _count(self, name, device_address, register_address, op, n_bytes, duration, timestamp, i_bin):
+        for counters in (self.per_bus.setdefault(name, _Counters(len(self.LATENCY_BINS))),
+                         self.per_device.setdefault((name, device_address), _Counters(len(self.LATENCY_BINS)))):
+            counters.transactions += 1
+            counters.time += duration
+            counters.histogram[i_bin] += 1
+            if op in (READ, TRANSFER):
+                counters.bytes_read += n_bytes
+            if op in (WRITE, TRANSFER):
+                counters.bytes_written += n_bytes
+
+        if self.trace and len(self.events) < self.max_trace_length:
+            self.events.append((timestamp, name, device_address, register_address, op, n_bytes, duration))
+
+
+    @property
+    def stats(self):
+        return {'buses'  : {name: c.as_dict(self.LATENCY_BINS) for name, c in self.per_bus.items()},
+                'devices': {key: c.as_dict(self.LATENCY_BINS) for key, c in self.per_device.items()}}
+
+
+    def summary(self):
+        lines = ['{:<24s}{:>8s}{:>12s}{:>12s}{:>12s}{:>12s}'.format('bus / device', 'n', 'read', 'written',
+                                                                   'time (s)', 'mean (us)')]
+
+        for (name, device_address), c in sorted(self.per_device.items(), key = lambda item: str(item[0])):
+            label = name if device_address is None else '{} / {}'.format(name, hex(device_address))
+            lines.append('{:<24s}{:>8d}{:>12d}{:>12d}{:>12.6f}{:>12.1f}'.format(
+                label, c.transactions, c.bytes_read, c.bytes_written, c.time, c.time / c.transactions * 1e6))
+
+        return '\n'.join(lines)
+
+
+    def print(self):
+        print(self.summary())
+
+
+    def save_trace(self, file_name):
+        with open(file_name, 'wt') as f:
+            f.write('timestamp, bus, device_address, register_address, op, n_bytes, duration\n')
+            for event in self.events:
+                f.write(', '.join('' if v is None else str(v) for v in event) + '\n')
@@ -14,22 +14,53 @@ IS_RPi = machine_name.startswith('armv')
 IS_MICROPYTHON = (sys.implementation.name == 'micropython')
 
 try:
-    from bridges.ftdi.controllers.gpio import GpioController
-    from bridges.ftdi.adapters.micropython.machine import Pin as ftdi_Pin
     from utilities.shift_register import ShiftRegister
+except ImportError:
+    from shift_register import ShiftRegister
 
+VIRTUAL_DEVICE_WARNING = '\n****** Virtual device. Data may not be real ! ******\n'
 
-    GPIO_PORT = GpioController()
-except Exception as e:
-    if not isinstance(e, ImportError):
-        print(e)
+BACKEND_RPi = 'RPi'
+BACKEND_uPy = 'uPy'
+BACKEND_Ftdi = 'Ftdi'
+BACKEND_Virtual = 'Virtual'  # simulated devices with the machine.I2C / machine.SPI API, see adapters.simulator
+BACKENDS = (BACKEND_RPi, BACKEND_uPy, BACKEND_Ftdi, BACKEND_Virtual)
 
-try:
-    from utilities.shift_register import ShiftRegister
-except:
-    from shift_register import ShiftRegister
+_default_backend = None
+_gpio_port = None
 
-VIRTUAL_DEVICE_WARNING = '\n****** Virtual device. Data may not be real ! ******\n'
+
+
+def get_backend(backend = None):
+    # the default backend follows the platform, and is resolved once, on first use.
+    global _default_backend
+
+    if backend is None:
+        if _default_backend is None:
+            _default_backend = BACKEND_RPi if IS_RPi else BACKEND_uPy if IS_MICROPYTHON else BACKEND_Ftdi
+        backend = _default_backend
+
+    assert backend in BACKENDS, 'backend needs to be one of {}, current: {}'.format(BACKENDS, backend)
+    return backend
+
+
+
+def set_default_backend(backend):
+    global _default_backend
+    _default_backend = get_backend(backend)
+
+
+
+def get_gpio_port():
+    # the FTDI bridge is imported and opened on first use only.
+    global _gpio_port
+
+    if _gpio_port is None:
+        from bridges.ftdi.controllers.gpio import GpioController
+
+        _gpio_port = GpioController()
+
+    return _gpio_port
 
 
 
@@ -38,8 +69,34 @@ class Mock:
 
 
 
+def _zero_fill(buf):
+    for i in range(len(buf)):
+        buf[i] = 0
+
+
+
+def _copy_into(buf, data):
+    memoryview(buf)[:len(data)] = data
+
+
+
+def _as_buffer(data):
+    # machine.I2C takes buffers only; other sequences, e.g. lists of ints, are copied once.
+    try:
+        memoryview(data)
+        return data
+    except TypeError:
+        return bytes(data)
+
+
+
 class Pin:
 
+    @classmethod
+    def get_pin(cls, pin_id, output = True, backend = None):
+        return getattr(cls, 'get_{}_pin'.format(get_backend(backend)))(pin_id, output = output)
+
+
     @classmethod
     def get_uPy_pin(cls, pin_id, output = True):
         import machine
@@ -76,7 +133,119 @@ class Pin:
 
     @classmethod
     def get_Ftdi_pin(cls, pin_id, output = True):
-        return ftdi_Pin(pin_id, mode = ftdi_Pin.OUT if output else ftdi_Pin.IN, gpio_port = GPIO_PORT)
+        from bridges.ftdi.adapters.micropython.machine import Pin as ftdi_Pin
+
+        return ftdi_Pin(pin_id, mode = ftdi_Pin.OUT if output else ftdi_Pin.IN, gpio_port = get_gpio_port())
+
+
+    @classmethod
+    def get_Virtual_pin(cls, pin_id, output = True):
+        try:
+            from utilities.adapters.simulator import SimulatedPin
+        except ImportError:
+            from simulator import SimulatedPin
+
+        return SimulatedPin(pin_id)
+
+
+
+class PinGroup:
+    # Output pins driven together: write(values) sets all of them, in as few backend calls as the backend allows.
+    # pins[i] still offers high() / low() for code that toggles a single pin.
+
+    def __init__(self, pins, write = None):
+        self.pins = list(pins)
+        self._write = write or self._write_each
+
+
+    def _write_each(self, values):
+        for pin, value in zip(self.pins, values):
+            _ = pin.high() if value else pin.low()
+
+
+    def write(self, values):
+        self._write(values)
+
+
+    def high(self):
+        self._write([1] * len(self.pins))
+
+
+    def low(self):
+        self._write([0] * len(self.pins))
+
+
+    @classmethod
+    def get_pin_group(cls, pin_ids, backend = None):
+        return getattr(cls, 'get_{}_pin_group'.format(get_backend(backend)))(pin_ids)
+
+
+    @classmethod
+    def get_uPy_pin_group(cls, pin_ids):
+        import machine
+
+        machine_pins = [machine.Pin(pin_id, machine.Pin.OUT) for pin_id in pin_ids]
+        pins = []
+
+        for machine_pin in machine_pins:
+            pin = Mock()
+            pin.low = lambda p = machine_pin: p.value(0)
+            pin.high = lambda p = machine_pin: p.value(1)
+            pins.append(pin)
+
+
+        def write(values):
+            for machine_pin, value in zip(machine_pins, values):
+                machine_pin.value(value)
+
+
+        return cls(pins, write = write)
+
+
+    @classmethod
+    def get_RPi_pin_group(cls, pin_ids):
+        import RPi.GPIO as GPIO
+
+        pin_ids = list(pin_ids)
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(pin_ids, GPIO.OUT)
+        pins = []
+
+        for pin_id in pin_ids:
+            pin = Mock()
+            pin.low = lambda p = pin_id: GPIO.output(p, GPIO.LOW)
+            pin.high = lambda p = pin_id: GPIO.output(p, GPIO.HIGH)
+            pins.append(pin)
+
+        return cls(pins, write = lambda values: GPIO.output(pin_ids, [int(bool(v)) for v in values]))
+
+
+    @classmethod
+    def get_Ftdi_pin_group(cls, pin_ids):
+        pins = [Pin.get_Ftdi_pin(pin_id) for pin_id in pin_ids]
+        port = get_gpio_port()
+
+        if not (hasattr(port, 'read') and hasattr(port, 'write')):
+            return cls(pins)
+
+        masks = [1 << pin_id for pin_id in pin_ids]
+        group_mask = sum(masks)
+
+
+        def write(values):
+            port_value = port.read() & ~group_mask
+            for mask, value in zip(masks, values):
+                if value:
+                    port_value |= mask
+            port.write(port_value)
+
+
+        return cls(pins, write = write)
+
+
+    @classmethod
+    def get_Virtual_pin_group(cls, pin_ids):
+        return cls([Pin.get_Virtual_pin(pin_id) for pin_id in pin_ids])
 
 
 
@@ -84,8 +253,9 @@ class Bus:
     DEBUG_MODE = False
 
 
-    def __init__(self, bus):
+    def __init__(self, bus, backend = None):
         self._bus = bus
+        self.backend = get_backend(backend)
 
         if self.is_virtual_device:
             print(VIRTUAL_DEVICE_WARNING)
@@ -94,11 +264,11 @@ class Bus:
 
 
     def init(self):
-        if IS_RPi:
+        if self.backend == BACKEND_RPi:
             raise NotImplementedError()
-        elif IS_MICROPYTHON:
+        elif self.backend == BACKEND_uPy:
             raise NotImplementedError()
-        elif IS_PC:
+        elif self.backend == BACKEND_Ftdi:
             raise NotImplementedError()
 
 
@@ -115,41 +285,151 @@ class Bus:
         raise NotImplementedError()
 
 
+    def readinto(self, buf):
+        raise NotImplementedError()
+
+
+    def write_readinto(self, write_buf, read_buf):
+        raise NotImplementedError()
+
+
+
+class _SPITransaction:
+
+    def __init__(self, spi):
+        self._spi = spi
+
+
+    def __enter__(self):
+        if self._spi._depth == 0 and not self._spi.is_virtual_device:
+            self._spi._select()
+        self._spi._depth += 1
+        return self._spi
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._spi._depth -= 1
+        if self._spi._depth == 0 and not self._spi.is_virtual_device:
+            self._spi._deselect()
+
+
+
+def _chunks(buf, chunk_size):
+    try:
+        buf = memoryview(buf)
+    except TypeError:
+        pass  # e.g. a list of ints, sliced as it is.
+
+    for i in range(0, len(buf), chunk_size):
+        yield buf[i:i + chunk_size]
+
+
 
 class SPI(Bus):
     SPI_MSB = 0
     SPI_LSB = 1
+    MAX_CHUNK_SIZE = 4096  # spidev default bufsiz
 
 
-    def __init__(self, spi, ss, ss_polarity = 1):
+    def __init__(self, spi, ss, ss_polarity = 1, backend = None):
         self._ss = ss
         self._ss_polarity = ss_polarity
-        super().__init__(bus = spi)
+        self._depth = 0
+        super().__init__(bus = spi, backend = backend)
 
 
     def init(self):
-        if IS_RPi:
-            self._write = self._bus.writebytes
-        elif IS_MICROPYTHON or IS_PC:
-            self._write = self._bus.write
+        if self.backend == BACKEND_RPi:
+
+
+            def write(buf):
+                for chunk in _chunks(buf, self.MAX_CHUNK_SIZE):
+                    self._bus.writebytes(list(chunk))
+
+
+            def readinto(buf):
+                for chunk in _chunks(buf, self.MAX_CHUNK_SIZE):
+                    _copy_into(chunk, bytes(self._bus.readbytes(len(chunk))))
+
+
+            def write_readinto(write_buf, read_buf):
+                # xfer3 splits large buffers itself; xfer2 needs chunking here.
+                xfer = getattr(self._bus, 'xfer3', None)
+                if xfer is not None:
+                    _copy_into(read_buf, bytes(xfer(list(write_buf))))
+                else:
+                    for chunk_out, chunk_in in zip(_chunks(write_buf, self.MAX_CHUNK_SIZE),
+                                                   _chunks(read_buf, self.MAX_CHUNK_SIZE)):
+                        _copy_into(chunk_in, bytes(self._bus.xfer2(list(chunk_out))))
+
+
+            # writebytes2 takes any buffer and splits it by bufsiz in C.
+            self._write = getattr(self._bus, 'writebytes2', write)
+            self._readinto = readinto
+            self._write_readinto = write_readinto
+
+        else:
+            # looked up at call time, so wrappers installed on the bus later, e.g. by instrumentation, are used.
+            self._write = lambda bytes_array: self._bus.write(bytes_array)
+            self._readinto = lambda buf: self._bus.readinto(buf)
+            self._write_readinto = None if not hasattr(self._bus, 'write_readinto') else \
+                lambda write_buf, read_buf: self._bus.write_readinto(write_buf, read_buf)
+
+
+    def transaction(self):
+        # with spi.transaction(): ...  keeps chip select asserted across several writes and reads.
+        return _SPITransaction(self)
+
+
+    def _select(self):
+        if self._ss_polarity == 0:
+            self._ss.low()
+        self._ss.high()
+        self._ss.low()
+
+
+    def _deselect(self):
+        self._ss.high()
+        if self._ss_polarity == 0:
+            self._ss.low()
 
 
     def write(self, bytes_array):
 
         if not self.is_virtual_device:
+            with self.transaction():
+                return self._write(bytes_array)
 
-            if self._ss_polarity == 0:
-                self._ss.low()
-            self._ss.high()
-            self._ss.low()
 
-            result = self._write(bytes_array)
+    def readinto(self, buf):
+
+        if not self.is_virtual_device:
+            with self.transaction():
+                self._readinto(buf)
+        else:
+            _zero_fill(buf)
 
-            self._ss.high()
-            if self._ss_polarity == 0:
-                self._ss.low()
+        return len(buf)
 
-            return result
+
+    def write_readinto(self, write_buf, read_buf):
+        assert len(write_buf) == len(read_buf), 'write_buf and read_buf need the same length.'
+
+        if not self.is_virtual_device:
+            if self._write_readinto is None:
+                raise NotImplementedError('Full-duplex transfer is not supported by this bus.')
+
+            with self.transaction():
+                self._write_readinto(write_buf, read_buf)
+        else:
+            _zero_fill(read_buf)
+
+        return len(read_buf)
+
+
+    @classmethod
+    def get_spi(cls, backend = None, **kwargs):
+        return getattr(cls, 'get_{}_spi'.format(get_backend(backend)))(**kwargs)
 
 
     @classmethod
@@ -191,33 +471,90 @@ class SPI(Bus):
     @classmethod
     def get_Ftdi_spi(cls, stb_pin, clk_pin, data_pin,
                      bits = ShiftRegister.BITS_IN_BYTE, lsbfirst = False,
-                     polarity = ShiftRegister.POLARITY_DEFAULT, phase = ShiftRegister.PHASE_DEFAULT):
+                     polarity = ShiftRegister.POLARITY_DEFAULT, phase = ShiftRegister.PHASE_DEFAULT,
+                     pin_group = None):
 
         return ShiftRegister(stb_pin = stb_pin, clk_pin = clk_pin, data_pin = data_pin, bits = bits,
                              lsbfirst = lsbfirst,
-                             polarity = polarity, phase = phase)
+                             polarity = polarity, phase = phase, pin_group = pin_group)
+
+
+    @classmethod
+    def get_Virtual_spi(cls, registers_map = None):
+        try:
+            from utilities.adapters.simulator import SimulatedDevice, SimulatedSPI
+            from utilities.register import RegistersMap
+        except ImportError:
+            from simulator import SimulatedDevice, SimulatedSPI
+            from register import RegistersMap
+
+        return SimulatedSPI(SimulatedDevice(registers_map or RegistersMap('')))
 
 
 
 class I2C(Bus):
+    MAX_BLOCK_SIZE = 32
+
 
-    def __init__(self, i2c):
-        super().__init__(bus = i2c)
+    def __init__(self, i2c, backend = None):
+        super().__init__(bus = i2c, backend = backend)
 
 
     def init(self):
-        if IS_RPi:
+        if self.backend == BACKEND_RPi:
+            from smbus2 import i2c_msg
+
+
+            def read_bytes(i2c_address, n_bytes):
+                msg_read = i2c_msg.read(i2c_address, n_bytes)
+                self._bus.i2c_rdwr(msg_read)
+                return array('B', list(msg_read))
+
+
+            def read_addressed_bytes(i2c_address, reg_address, n_bytes):
+                # write register address then read back, with a repeated start in between.
+                msg_read = i2c_msg.read(i2c_address, n_bytes)
+                self._bus.i2c_rdwr(i2c_msg.write(i2c_address, [reg_address]), msg_read)
+                return array('B', list(msg_read))
+
+
+            def readinto(i2c_address, buf):
+                msg_read = i2c_msg.read(i2c_address, len(buf))
+                self._bus.i2c_rdwr(msg_read)
+                _copy_into(buf, bytes(msg_read))
+
+
+            def read_addressed_into(i2c_address, reg_address, buf):
+                msg_read = i2c_msg.read(i2c_address, len(buf))
+                self._bus.i2c_rdwr(i2c_msg.write(i2c_address, [reg_address]), msg_read)
+                _copy_into(buf, bytes(msg_read))
+
+
+            def write_vectored(i2c_address, buffers):
+                self._bus.i2c_rdwr(i2c_msg.write(i2c_address, [b for buf in buffers for b in buf]))
+
 
             self._read_addressed_byte = \
                 lambda i2c_address, reg_address: self._bus.read_byte_data(i2c_address, reg_address)
             self._write_addressed_byte = \
                 lambda i2c_address, reg_address, value: self._bus.write_byte_data(i2c_address, reg_address, value)
 
-            # not sure how to implement read_bytes / write_bytes on RPi.
+            self._read_bytes = read_bytes
+            self._read_addressed_bytes = read_addressed_bytes
+            self._write_bytes = \
+                lambda i2c_address, bytes_array: self._bus.i2c_rdwr(i2c_msg.write(i2c_address, list(bytes_array)))
+            self._write_addressed_from = \
+                lambda i2c_address, reg_address, buf: write_vectored(i2c_address, ((reg_address,), buf))
+
+            self._readinto = readinto
+            self._read_addressed_into = read_addressed_into
+            self._write_vectored = write_vectored
 
-        elif IS_MICROPYTHON or IS_PC:
+        else:
             self._read_addressed_byte = \
                 lambda i2c_address, reg_address: self._bus.readfrom_mem(i2c_address, reg_address, 1)[0]
+            self._read_addressed_bytes = \
+                lambda i2c_address, reg_address, n_bytes: self._bus.readfrom_mem(i2c_address, reg_address, n_bytes)
             self._write_addressed_byte = \
                 lambda i2c_address, reg_address, value: self._bus.writeto_mem(i2c_address, reg_address,
                                                                               array('B', [value]))
@@ -226,6 +563,37 @@ class I2C(Bus):
             self._write_bytes = lambda i2c_address, bytes_array: self._bus.writeto(i2c_address, bytes_array)
             self.writeto = self._bus.writeto
 
+            self._write_addressed_from = \
+                lambda i2c_address, reg_address, buf: self._bus.writeto_mem(i2c_address, reg_address,
+                                                                            _as_buffer(buf))
+
+            # the FTDI bridge may not offer the buffer-protocol methods of machine.I2C.
+            if hasattr(self._bus, 'readfrom_mem_into'):
+                self._readinto = self._bus.readfrom_into
+                self._read_addressed_into = self._bus.readfrom_mem_into
+                self._write_vectored = \
+                    lambda i2c_address, buffers: self._bus.writevto(i2c_address,
+                                                                    [_as_buffer(buf) for buf in buffers])
+
+            else:
+
+
+                def readinto(i2c_address, buf):
+                    _copy_into(buf, self._bus.readfrom(i2c_address, len(buf)))
+
+
+                def read_addressed_into(i2c_address, reg_address, buf):
+                    _copy_into(buf, self._bus.readfrom_mem(i2c_address, reg_address, len(buf)))
+
+
+                def write_vectored(i2c_address, buffers):
+                    self._bus.writeto(i2c_address, bytes(b for buf in buffers for b in buf))
+
+
+                self._readinto = readinto
+                self._read_addressed_into = read_addressed_into
+                self._write_vectored = write_vectored
+
 
     def read_bytes(self, i2c_address, n_bytes):
         if not self.is_virtual_device:
@@ -237,20 +605,68 @@ class I2C(Bus):
         return self.read_bytes(i2c_address = i2c_address, n_bytes = 1)[0]
 
 
+    def readinto(self, i2c_address, buf):
+        if not self.is_virtual_device:
+            self._readinto(i2c_address, buf)
+        else:
+            _zero_fill(buf)
+
+        return len(buf)
+
+
     def read_addressed_bytes(self, i2c_address, reg_address, n_bytes):
         if not self.is_virtual_device:
-            self.write_byte(i2c_address = i2c_address, value = reg_address)
-            return self.read_bytes(i2c_address = i2c_address, n_bytes = n_bytes)
+            return self._read_addressed_bytes(i2c_address, reg_address, n_bytes)
 
         return array('B', [0] * n_bytes)
 
 
+    def read_addressed_into(self, i2c_address, reg_address, buf):
+        if not self.is_virtual_device:
+            self._read_addressed_into(i2c_address, reg_address, buf)
+        else:
+            _zero_fill(buf)
+
+        return len(buf)
+
+
     def read_addressed_byte(self, i2c_address, reg_address):
         if not self.is_virtual_device:
             return self._read_addressed_byte(i2c_address, reg_address)
         return 0
 
 
+    @classmethod
+    def plan_block_reads(cls, reg_addresses, max_gap = 0, max_block_size = MAX_BLOCK_SIZE):
+        # merge register addresses into (start, n_bytes) blocks,
+        # allowing up to max_gap unwanted bytes between wanted ones.
+        blocks = []
+
+        for address in sorted(set(reg_addresses)):
+            if blocks:
+                start, n_bytes = blocks[-1]
+                if address - (start + n_bytes) <= max_gap and address - start < max_block_size:
+                    blocks[-1] = (start, address - start + 1)
+                    continue
+            blocks.append((address, 1))
+
+        return blocks
+
+
+    def read_registers(self, i2c_address, reg_addresses, max_gap = 0, max_block_size = MAX_BLOCK_SIZE):
+        reg_addresses = set(reg_addresses)
+        values = {}
+
+        for start, n_bytes in self.plan_block_reads(reg_addresses, max_gap, max_block_size):
+            bytes_array = self.read_addressed_bytes(i2c_address = i2c_address, reg_address = start, n_bytes = n_bytes)
+
+            for i in range(n_bytes):
+                if start + i in reg_addresses:
+                    values[start + i] = bytes_array[i]
+
+        return values
+
+
     def write_bytes(self, i2c_address, bytes_array):
         if not self.is_virtual_device:
             return self._write_bytes(i2c_address, bytes_array)
@@ -260,15 +676,23 @@ class I2C(Bus):
         return self.write_bytes(i2c_address = i2c_address, bytes_array = array('B', [value]))
 
 
-    def write_addressed_bytes(self, i2c_address, reg_address, bytes_array):
-        n_bytes = len(bytes_array)
+    def write_vectored(self, i2c_address, buffers):
+        # scatter-gather write: all buffers go out in one transaction, without being joined first.
+        if not self.is_virtual_device:
+            self._write_vectored(i2c_address, buffers)
+
+        return sum(len(buf) for buf in buffers)
 
+
+    def write_addressed_from(self, i2c_address, reg_address, buf):
         if not self.is_virtual_device:
-            ba = array('B', [reg_address])
-            ba.extend(bytes_array)
-            self.write_bytes(i2c_address = i2c_address, bytes_array = ba)
+            self._write_addressed_from(i2c_address, reg_address, buf)
+
+        return len(buf)
+
 
-        return n_bytes
+    def write_addressed_bytes(self, i2c_address, reg_address, bytes_array):
+        return self.write_addressed_from(i2c_address = i2c_address, reg_address = reg_address, buf = bytes_array)
 
 
     def write_addressed_byte(self, i2c_address, reg_address, value):
@@ -276,6 +700,11 @@ class I2C(Bus):
             return self._write_addressed_byte(i2c_address, reg_address, value)
 
 
+    @classmethod
+    def get_i2c(cls, backend = None, **kwargs):
+        return getattr(cls, 'get_{}_i2c'.format(get_backend(backend)))(**kwargs)
+
+
     @classmethod
     def get_uPy_i2c(cls, id = -1, scl_pin_id = 5, sda_pin_id = 4, freq = 400000):
         import machine
@@ -302,3 +731,13 @@ class I2C(Bus):
         from bridges.ftdi.controllers.i2c import I2cController
 
         return I2cController().I2C(freq = 400000)
+
+
+    @classmethod
+    def get_Virtual_i2c(cls, devices = None):
+        try:
+            from utilities.adapters.simulator import SimulatedI2C
+        except ImportError:
+            from simulator import SimulatedI2C
+
+        return SimulatedI2C(devices)
@@ -0,0 +1,357 @@
+import heapq
+import threading
+from time import monotonic
+
+
+PRIORITY_CONTROL = 0
+PRIORITY_NORMAL = 5
+PRIORITY_BULK = 10
+
+
+
+class Transaction:
+    READ = 'read'
+    WRITE = 'write'
+    CALL = 'call'
+
+
+    def __init__(self, op, priority, deadline, submitted_at, seq,
+                 device_address = None, reg_address = None, data = None, func = None, args = ()):
+        self.op = op
+        self.priority = priority
+        self.deadline = deadline
+        self.submitted_at = submitted_at
+        self.seq = seq
+        self.device_address = device_address
+        self.reg_address = reg_address
+        self.data = data
+        self.func = func
+        self.args = args
+
+        self.result = None
+        self.error = None
+        self.merged = False
+        self._done = threading.Event()
+
+
+    @property
+    def sort_key(self):
+        return self.priority, float('inf') if self.deadline is None else self.deadline, self.seq
+
+
+    def __lt__(self, other):
+        return self.sort_key < other.sort_key
+
+
+    def overlaps(self, other):
+        # reads carry n_bytes in data, writes the bytes themselves.
+        size = len(self.data) if self.op == self.WRITE else self.data
+        other_size = len(other.data) if other.op == self.WRITE else other.data
+
+        return self.device_address == other.device_address and \
+               self.reg_address < other.reg_address + other_size and other.reg_address < self.reg_address + size
+
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+
+    def wait(self, timeout = None):
+        if not self._done.wait(timeout):
+            raise TimeoutError('Transaction not executed within {} s.'.format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+    def _finish(self, result = None, error = None):
+        self.result = result
+        self.error = error
+        self._done.set()
+
+
+
+class BusScheduler:
+    # Queues transactions for one shared bus, ordered by priority (lower is more urgent), then deadline.
+    # Pending writes to the same device with contiguous register ranges are sent as one burst,
+    # as long as no write overtakes a read, a call, or an overlapping write that was due before it.
+    # A more urgent transaction that must not overtake an earlier one promotes it to its own priority and deadline.
+
+    def __init__(self, bus, max_burst_size = 32, clock = monotonic):
+        self.bus = bus
+        self.max_burst_size = max_burst_size
+        self.clock = clock
+
+        self._queue = []
+        self._pending_writes = {}
+        self._pending_reads = {}
+        self._pending_calls = []
+        self._seq = 0
+        self._n_stale = 0
+        self._lock = threading.Lock()
+        self._bus_lock = threading.Lock()
+        self._has_work = threading.Condition(self._lock)
+        self._worker = None
+        self._running = False
+
+        self.reset_stats()
+
+
+    def reset_stats(self):
+        self.n_submitted = 0
+        self.n_bus_transactions = 0
+        self.n_merged = 0
+        self.n_deadline_misses = 0
+        self.max_queue_depth = 0
+        self._wait_stats = {}
+
+
+    @property
+    def queue_depth(self):
+        return len(self._queue) - self._n_stale
+
+
+    def _submit(self, op, priority, deadline, **kwargs):
+        with self._lock:
+            transaction = Transaction(op, priority, deadline, self.clock(), self._seq, **kwargs)
+            self._seq += 1
+            if self._promote_conflicts(transaction):
+                heapq.heapify(self._queue)
+            heapq.heappush(self._queue, transaction)
+
+            if op == Transaction.WRITE:
+                self._pending_writes.setdefault(transaction.device_address, []).append(transaction)
+            elif op == Transaction.READ:
+                self._pending_reads.setdefault(transaction.device_address, []).append(transaction)
+            else:
+                self._pending_calls.append(transaction)
+
+            self.n_submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+            self._has_work.notify()
+
+        return transaction
+
+
+    def submit_write(self, i2c_address, reg_address, bytes_array, priority = PRIORITY_NORMAL, deadline = None):
+        return self._submit(Transaction.WRITE, priority, deadline,
+                            device_address = i2c_address, reg_address = reg_address, data = bytes(bytes_array))
+
+
+    def submit_read(self, i2c_address, reg_address, n_bytes, priority = PRIORITY_NORMAL, deadline = None):
+        return self._submit(Transaction.READ, priority, deadline,
+                            device_address = i2c_address, reg_address = reg_address, data = n_bytes)
+
+
+    def submit(self, func, *args, priority = PRIORITY_NORMAL, deadline = None):
+        # any other bus call, e.g. SPI.write; executed as is, never merged.
+        return self._submit(Transaction.CALL, priority, deadline, func = func, args = args)
+
+
+    def _conflicts(self, transaction):
+        # earlier pending transactions that transaction may not overtake.
+        if transaction.op == Transaction.WRITE:
+            return self._pending_calls + self._pending_reads.get(transaction.device_address, []) + \
+                   [t for t in self._pending_writes.get(transaction.device_address, []) if t.overlaps(transaction)]
+
+        if transaction.op == Transaction.READ:
+            return [t for t in self._pending_writes.get(transaction.device_address, []) if t.overlaps(transaction)]
+
+        return []
+
+
+    def _promote_conflicts(self, transaction):
+        promoted = False
+
+        for t in self._conflicts(transaction):
+            if t.seq < transaction.seq and transaction.sort_key < t.sort_key:
+                t.priority = min(t.priority, transaction.priority)
+                if transaction.deadline is not None and (t.deadline is None or transaction.deadline < t.deadline):
+                    t.deadline = transaction.deadline
+                self._promote_conflicts(t)
+                promoted = True
+
+        return promoted
+
+
+    def _pop(self):
+        while self._queue:
+            transaction = heapq.heappop(self._queue)
+            if not transaction.merged:
+                return transaction
+            self._n_stale -= 1
+
+
+    def _remove_pending(self, transaction):
+        if transaction.op == Transaction.READ:
+            pending = self._pending_reads[transaction.device_address]
+            pending.remove(transaction)
+            if not pending:
+                del self._pending_reads[transaction.device_address]
+        elif transaction.op == Transaction.CALL:
+            self._pending_calls.remove(transaction)
+
+
+    def _may_overtake(self, candidate, pending):
+        # candidate runs early, so nothing it could be reordered against may be due before it.
+        key = candidate.sort_key
+        end = candidate.reg_address + len(candidate.data)
+
+        for t in self._pending_calls + self._pending_reads.get(candidate.device_address, []):
+            if t.sort_key < key:
+                return False
+
+        for t in pending:
+            if t is not candidate and t.sort_key < key and \
+                    t.reg_address < end and candidate.reg_address < t.reg_address + len(t.data):
+                return False
+
+        return True
+
+
+    def _collect_burst(self, transaction):
+        # grow [start, end) with pending writes to the same device that extend it on either side.
+        pending = self._pending_writes[transaction.device_address]
+        pending.remove(transaction)
+        start = transaction.reg_address
+        end = start + len(transaction.data)
+        burst = [transaction]
+
+        extended = True
+        while extended and pending:
+            extended = False
+
+            for candidate in pending:
+                size = len(candidate.data)
+
+                if end - start + size > self.max_burst_size or not self._may_overtake(candidate, pending):
+                    continue
+
+                if candidate.reg_address == end:
+                    end += size
+                    burst.append(candidate)
+                elif candidate.reg_address + size == start:
+                    start -= size
+                    burst.insert(0, candidate)
+                else:
+                    continue
+
+                pending.remove(candidate)
+                candidate.merged = True
+                self._n_stale += 1
+                extended = True
+                break
+
+        if not pending:
+            del self._pending_writes[transaction.device_address]
+
+        return start, burst
+
+
+    def _record_wait(self, transaction, now):
+        waited = now - transaction.submitted_at
+        count, total, longest = self._wait_stats.get(transaction.priority, (0, 0.0, 0.0))
+        self._wait_stats[transaction.priority] = (count + 1, total + waited, max(longest, waited))
+
+        if transaction.deadline is not None and now > transaction.deadline:
+            self.n_deadline_misses += 1
+
+
+    def _execute(self, transaction):
+        if transaction.op == Transaction.WRITE:
+            return self.bus.write_addressed_bytes(transaction.device_address, transaction.reg_address,
+                                                  transaction.data)
+
+        if transaction.op == Transaction.READ:
+            return self.bus.read_addressed_bytes(transaction.device_address, transaction.reg_address,
+                                                 transaction.data)
+
+        return transaction.func(*transaction.args)
+
+
+    def run_once(self):
+        with self._bus_lock:
+            with self._lock:
+                transaction = self._pop()
+                if transaction is None:
+                    return False
+
+                if transaction.op == Transaction.WRITE:
+                    start, burst = self._collect_burst(transaction)
+                    self.n_merged += len(burst) - 1
+                else:
+                    self._remove_pending(transaction)
+                    start, burst = transaction.reg_address, [transaction]
+
+                now = self.clock()
+                for t in burst:
+                    self._record_wait(t, now)
+
+            if len(burst) > 1:
+                head = burst[0]
+                transaction = Transaction(Transaction.WRITE, head.priority, head.deadline, now, head.seq,
+                                          device_address = head.device_address, reg_address = start,
+                                          data = b''.join(t.data for t in burst))
+
+            try:
+                result, error = self._execute(transaction), None
+            except Exception as e:
+                result, error = None, e
+
+            with self._lock:
+                self.n_bus_transactions += 1
+
+            for t in burst:
+                t._finish(len(t.data) if len(burst) > 1 else result, error)
+
+            return True
+
+
+    def run_pending(self, max_transactions = None):
+        n = 0
+        while (max_transactions is None or n < max_transactions) and self.run_once():
+            n += 1
+        return n
+
+
+    def _run_forever(self):
+        while True:
+            with self._lock:
+                while self._running and not self.queue_depth:
+                    self._has_work.wait()
+                if not self._running:
+                    return
+            self.run_once()
+
+
+    def start(self):
+        if self._worker is None:
+            self._running = True
+            self._worker = threading.Thread(target = self._run_forever, daemon = True)
+            self._worker.start()
+
+
+    def stop(self):
+        if self._worker is not None:
+            with self._lock:
+                self._running = False
+                self._has_work.notify()
+            self._worker.join()
+            self._worker = None
+
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {'queue_depth'      : self.queue_depth,
+                    'max_queue_depth'  : self.max_queue_depth,
+                    'submitted'        : self.n_submitted,
+                    'bus_transactions' : self.n_bus_transactions,
+                    'merged'           : self.n_merged,
+                    'deadline_misses'  : self.n_deadline_misses,
+                    'wait_by_priority' : {priority: {'count': count,
+                                                     'mean' : total / count,
+                                                     'max'  : longest}
+                                          for priority, (count, total, longest) in
+                                          sorted(self._wait_stats.items())}}
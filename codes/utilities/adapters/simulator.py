@@ -0,0 +1,279 @@
+# Simulated register-file devices for the 'Virtual' backend:
+#
+#   bus = SimulatedI2C()
+#   bus.add_device(0x40, registers_map)
+#   i2c = I2C(bus, backend = 'Virtual')
+#
+#   spi_bus = SimulatedSPI(SimulatedDevice(registers_map))
+#   spi = SPI(spi_bus, spi_bus.ss_pin, backend = 'Virtual')
+#
+# A register occupies n_bytes consecutive byte addresses from its address, big endian.
+# Reads and writes auto-increment the register pointer, wrapping around at the end of the register file.
+# Host writes leave read-only element bits unchanged; SimulatedDevice.set() changes them from the device side.
+#
+# Pin.get_pin(pin_id, backend = 'Virtual'), I2C.get_i2c(backend = 'Virtual') etc. return these simulators.
+
+import weakref
+
+
+_layouts = weakref.WeakKeyDictionary()
+
+
+
+def _layout(registers_map):
+    # defaults and writable-bit masks, computed once per map and shared by all devices built from it;
+    # recomputed when registers_map.registers is reassigned, dropped when the map is.
+    layout = _layouts.get(registers_map)
+
+    if layout is None or layout[0] is not registers_map.registers:
+        size = max([reg.address + reg.n_bytes for reg in registers_map.registers.values()] + [1])
+        defaults = bytearray(size)
+        writable = bytearray(size)
+
+        for reg in registers_map.registers.values():
+            n_bytes = reg.n_bytes
+            mask = sum(e.mask for e in reg.elements.values() if not e.read_only)
+            defaults[reg.address:reg.address + n_bytes] = reg.default_value.to_bytes(n_bytes, 'big')
+            writable[reg.address:reg.address + n_bytes] = mask.to_bytes(n_bytes, 'big')
+
+        layout = _layouts[registers_map] = (registers_map.registers, bytes(defaults), bytes(writable))
+
+    return layout[1:]
+
+
+
+class SimulatedPin:
+
+    def __init__(self, pin_id = None, value = 0):
+        self.pin_id = pin_id
+        self._value = value
+
+
+    def high(self):
+        self._value = 1
+
+
+    def low(self):
+        self._value = 0
+
+
+    def value(self, value = None):
+        if value is None:
+            return self._value
+        self._value = 1 if value else 0
+
+
+
+class SimulatedDevice:
+
+    def __init__(self, registers_map):
+        self.registers_map = registers_map
+        self._defaults, self._writable = _layout(registers_map)
+        self.memory = bytearray(self._defaults)
+        self.pointer = 0
+
+
+    @property
+    def size(self):
+        return len(self.memory)
+
+
+    def reset(self):
+        self.memory[:] = self._defaults
+        self.pointer = 0
+
+
+    def readinto(self, buf, reg_address = None):
+        memory = self.memory
+        size = len(memory)
+        pointer = self.pointer if reg_address is None else reg_address
+        n_bytes = len(buf)
+
+        if pointer + n_bytes <= size:
+            memoryview(buf)[:n_bytes] = memory[pointer:pointer + n_bytes]
+        else:
+            for i in range(n_bytes):
+                buf[i] = memory[(pointer + i) % size]
+
+        self.pointer = (pointer + len(buf)) % size
+
+
+    def write(self, data, reg_address = None):
+        memory = self.memory
+        writable = self._writable
+        size = len(memory)
+        pointer = self.pointer if reg_address is None else reg_address
+
+        for i in range(len(data)):
+            address = (pointer + i) % size
+            mask = writable[address]
+            memory[address] = (memory[address] & ~mask) | (data[i] & mask)
+
+        self.pointer = (pointer + len(data)) % size
+
+
+    def set(self, reg_address, data):
+        # device side update, read-only bits included; wraps around at the end like host writes.
+        memory = self.memory
+        size = len(memory)
+
+        for i in range(len(data)):
+            memory[(reg_address + i) % size] = data[i]
+
+
+    @property
+    def addressed_values(self):
+        return sorted((reg.address, int.from_bytes(self.memory[reg.address:reg.address + reg.n_bytes], 'big'))
+                      for reg in self.registers_map.registers.values())
+
+
+
+class SimulatedI2C:
+    # machine.I2C compatible bus holding simulated devices by I2C address.
+    ENODEV = 19
+
+
+    def __init__(self, devices = None):
+        self.devices = dict(devices or {})
+
+
+    def add_device(self, i2c_address, registers_map):
+        device = SimulatedDevice(registers_map)
+        self.devices[i2c_address] = device
+        return device
+
+
+    def _device(self, i2c_address):
+        try:
+            return self.devices[i2c_address]
+        except KeyError:
+            raise OSError(self.ENODEV, 'No device at I2C address {}.'.format(hex(i2c_address)))
+
+
+    def scan(self):
+        return sorted(self.devices)
+
+
+    def readfrom_into(self, i2c_address, buf):
+        self._device(i2c_address).readinto(buf)
+
+
+    def readfrom(self, i2c_address, n_bytes):
+        buf = bytearray(n_bytes)
+        self.readfrom_into(i2c_address, buf)
+        return bytes(buf)
+
+
+    def readfrom_mem_into(self, i2c_address, reg_address, buf):
+        self._device(i2c_address).readinto(buf, reg_address)
+
+
+    def readfrom_mem(self, i2c_address, reg_address, n_bytes):
+        buf = bytearray(n_bytes)
+        self.readfrom_mem_into(i2c_address, reg_address, buf)
+        return bytes(buf)
+
+
+    def writeto_mem(self, i2c_address, reg_address, buf):
+        self._device(i2c_address).write(buf, reg_address)
+
+
+    def writevto(self, i2c_address, buffers):
+        # the first byte sets the register pointer, the rest is written from there.
+        device = self._device(i2c_address)
+        first = True
+
+        for buf in buffers:
+            if first and len(buf):
+                device.pointer = buf[0] % device.size
+                buf = memoryview(buf)[1:]
+                first = False
+            device.write(buf)
+
+
+    def writeto(self, i2c_address, buf):
+        self.writevto(i2c_address, (buf,))
+
+
+
+class _SelectPin:
+
+    def __init__(self, spi):
+        self._spi = spi
+
+
+    def low(self):
+        self._spi.begin()
+
+
+    def high(self):
+        self._spi.end()
+
+
+
+class SimulatedSPI:
+    # machine.SPI compatible. The first byte of a frame is the register address, READ_FLAG set for reads;
+    # the frame continues with data written to, or read from, consecutive registers.
+    # ss_pin is the active-low chip select: low() starts a frame, high() ends it.
+    READ_FLAG = 0x80
+
+
+    def __init__(self, device):
+        self.device = device
+        self.ss_pin = _SelectPin(self)
+        self._header = None
+
+
+    def begin(self):
+        self._header = None
+
+
+    def end(self):
+        self._header = None
+
+
+    def _consume_header(self, value):
+        self._header = value
+        self.device.pointer = (value & ~self.READ_FLAG) % self.device.size
+
+
+    def write(self, buf):
+        mv = memoryview(buf)
+
+        if self._header is None and len(mv):
+            self._consume_header(mv[0])
+            mv = mv[1:]
+
+        if self._header is not None and not self._header & self.READ_FLAG:
+            self.device.write(mv)
+
+
+    def readinto(self, buf, write_value = 0x00):
+        if self._header is None:
+            raise OSError('No register address was written in this frame.')
+
+        if self._header & self.READ_FLAG:
+            self.device.readinto(buf)
+        else:
+            for i in range(len(buf)):
+                buf[i] = 0
+
+
+    def write_readinto(self, write_buf, read_buf):
+        mv_out = memoryview(write_buf)
+        mv_in = memoryview(read_buf)
+
+        if self._header is None and len(mv_out):
+            self._consume_header(mv_out[0])
+            mv_in[0] = 0
+            mv_out, mv_in = mv_out[1:], mv_in[1:]
+
+        if self._header is None:
+            return
+
+        if self._header & self.READ_FLAG:
+            self.device.readinto(mv_in)
+        else:
+            self.device.write(mv_out)
+            for i in range(len(mv_in)):
+                mv_in[i] = 0
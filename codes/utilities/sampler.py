@@ -0,0 +1,243 @@
+import time
+from array import array
+
+try:
+    from utilities.register import Element
+except ImportError:
+    from register import Element
+
+
+
+class _TicksClock:
+    # MicroPython has no time.monotonic; time.ticks_us wraps around, so successive ticks_diff are summed,
+    # which holds as long as the clock is read at least once every half wrap period.
+
+    def __init__(self):
+        self._last = time.ticks_us()
+        self._seconds = 0.0
+
+
+    def __call__(self):
+        now = time.ticks_us()
+        self._seconds += time.ticks_diff(now, self._last) / 1e6
+        self._last = now
+        return self._seconds
+
+
+
+def _default_clock():
+    return time.monotonic if hasattr(time, 'monotonic') else _TicksClock()
+
+
+
+class RegisterSampler:
+    # Reads a set of registers at a fixed rate into a preallocated ring buffer of raw bytes;
+    # values are only decoded when asked for. A register takes n_bytes consecutive addresses, big endian.
+    JITTER_BINS = (10e-6, 50e-6, 100e-6, 500e-6, 1e-3, 5e-3, float('inf'))
+    SPIN_TIME = 200e-6
+
+
+    def __init__(self, registers_map, names, rate, i2c, i2c_address, capacity = 1024, max_gap = 0,
+                 use_numpy = False, clock = None, sleep = time.sleep):
+        self.registers_map = registers_map
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.i2c = i2c
+        self.i2c_address = i2c_address
+        self.capacity = capacity
+        self.clock = clock or _default_clock()
+        self.sleep = sleep
+
+        self._fields = {name: self._resolve(name) for name in names}
+        self.registers = sorted({reg for reg, _ in self._fields.values()}, key = lambda reg: reg.address)
+
+        addresses = [reg.address + i for reg in self.registers for i in range(reg.n_bytes)]
+        self.blocks = i2c.plan_block_reads(addresses, max_gap = max_gap)
+
+        # offset of each block, and of each register, inside one frame.
+        self._block_offsets = []
+        offset = 0
+        for start, n_bytes in self.blocks:
+            self._block_offsets.append(offset)
+            offset += n_bytes
+        self.frame_size = offset
+
+        self._register_offsets = {}
+        for reg in self.registers:
+            for (start, n_bytes), block_offset in zip(self.blocks, self._block_offsets):
+                if start <= reg.address < start + n_bytes:
+                    self._register_offsets[reg.name] = block_offset + reg.address - start
+
+        if use_numpy:
+            import numpy as np
+
+            self._frames = np.zeros((capacity, self.frame_size), dtype = np.uint8)
+            self._timestamps = np.zeros(capacity)
+            self._views = [memoryview(frame) for frame in self._frames]
+        else:
+            self._frames = bytearray(capacity * self.frame_size)
+            self._timestamps = array('d', [0.0] * capacity)
+            frames = memoryview(self._frames)
+            self._views = [frames[i * self.frame_size:(i + 1) * self.frame_size] for i in range(capacity)]
+
+        self._block_views = [[view[offset:offset + n_bytes] for (_, n_bytes), offset in zip(self.blocks,
+                                                                                             self._block_offsets)]
+                             for view in self._views]
+        self.use_numpy = use_numpy
+        self.reset_stats()
+
+
+    def _resolve(self, name):
+        if name in self.registers_map.registers:
+            return self.registers_map.registers[name], None
+
+        d = self.registers_map.elements[name]
+        return d['register'], d['element']
+
+
+    def reset_stats(self):
+        self.n_samples = 0
+        self.n_overruns = 0
+        self.n_bus_overruns = 0
+        self.jitter_histogram = [0] * len(self.JITTER_BINS)
+        self.max_jitter = 0.0
+        self.read_time_total = 0.0
+        self.read_time_max = 0.0
+        self._first_timestamp = None
+        self._last_timestamp = None
+
+
+    def sample(self, timestamp = None):
+        idx = self.n_samples % self.capacity
+        t0 = self.clock()
+
+        for (start, _), view in zip(self.blocks, self._block_views[idx]):
+            self.i2c.read_addressed_into(self.i2c_address, start, view)
+
+        read_time = self.clock() - t0
+        self.read_time_total += read_time
+        self.read_time_max = max(self.read_time_max, read_time)
+        if read_time > self.period:
+            self.n_bus_overruns += 1
+
+        timestamp = t0 if timestamp is None else timestamp
+        self._timestamps[idx] = timestamp
+        if self._first_timestamp is None:
+            self._first_timestamp = timestamp
+        self._last_timestamp = timestamp
+        self.n_samples += 1
+
+
+    def _record_jitter(self, jitter):
+        self.max_jitter = max(self.max_jitter, jitter)
+        for i, edge in enumerate(self.JITTER_BINS):
+            if jitter < edge:
+                self.jitter_histogram[i] += 1
+                break
+
+
+    def run(self, n_samples = None, duration = None):
+        # each sample is due at start + k * period, so lateness never accumulates into drift.
+        # slots that are already a whole period late are skipped and counted as overruns.
+        clock = self.clock
+        period = self.period
+        due = clock()
+        end = None if duration is None else due + duration
+        n = 0
+
+        while (n_samples is None or n < n_samples) and (end is None or due < end):
+            remaining = due - clock()
+            if remaining > self.SPIN_TIME:
+                self.sleep(remaining - self.SPIN_TIME)
+            while clock() < due:
+                pass
+
+            now = clock()
+            late = now - due
+            if late >= period:
+                missed = int(late // period)
+                self.n_overruns += missed
+                due += missed * period
+                late -= missed * period
+
+            self._record_jitter(late)
+            self.sample(now)
+            due += period
+            n += 1
+
+        return n
+
+
+    @property
+    def n_buffered(self):
+        return min(self.n_samples, self.capacity)
+
+
+    def _order(self):
+        if self.n_samples <= self.capacity:
+            return list(range(self.n_samples))
+        idx = self.n_samples % self.capacity
+        return list(range(idx, self.capacity)) + list(range(idx))
+
+
+    def timestamps(self):
+        order = self._order()
+        return self._timestamps[order] if self.use_numpy else [self._timestamps[i] for i in order]
+
+
+    def raw_values(self, register_name):
+        reg = self.registers_map.registers[register_name]
+        offset = self._register_offsets[register_name]
+        order = self._order()
+
+        if self.use_numpy:
+            import numpy as np
+
+            words = np.zeros(len(order), dtype = np.uint64)
+            for i in range(reg.n_bytes):
+                words = (words << np.uint64(8)) | self._frames[order, offset + i]
+            return words
+
+        return [int.from_bytes(self._views[i][offset:offset + reg.n_bytes], 'big') for i in order]
+
+
+    def values(self, name):
+        reg, element = self._fields[name]
+        words = self.raw_values(reg.name)
+
+        if element is None:
+            return words
+
+        if self.use_numpy:
+            return (words & element.mask) >> element.idx_lowest_bit
+
+        return [Element.section_value(word, element.idx_lowest_bit, element.n_bits) for word in words]
+
+
+    def load_latest(self):
+        # decode the latest sample into the registers map.
+        # values read from the device, so read-only elements are loaded too, unlike Register.load_value().
+        if self.n_samples:
+            view = self._views[(self.n_samples - 1) % self.capacity]
+
+            for reg in self.registers:
+                offset = self._register_offsets[reg.name]
+                word = int.from_bytes(view[offset:offset + reg.n_bytes], 'big')
+                for e in reg.elements.values():
+                    e._value = Element.section_value(word, e.idx_lowest_bit, e.n_bits)
+
+
+    @property
+    def stats(self):
+        elapsed = (self._last_timestamp or 0.0) - (self._first_timestamp or 0.0)
+
+        return {'samples'          : self.n_samples,
+                'rate'             : self.rate,
+                'achieved_rate'    : (self.n_samples - 1) / elapsed if elapsed > 0 else 0.0,
+                'overruns'         : self.n_overruns,
+                'bus_overruns'     : self.n_bus_overruns,
+                'overwritten'      : max(0, self.n_samples - self.capacity),
+                'max_jitter'       : self.max_jitter,
+                'jitter_histogram' : list(zip(self.JITTER_BINS, self.jitter_histogram)),
+                'read_time_mean'   : self.read_time_total / self.n_samples if self.n_samples else 0.0,
+                'read_time_max'    : self.read_time_max}
@@ -15,7 +15,7 @@ class ShiftRegister:
 
     def __init__(self, stb_pin, clk_pin, data_pin,
                  bits = BITS_IN_BYTE, lsbfirst = False,
-                 polarity = POLARITY_DEFAULT, phase = PHASE_DEFAULT, stb_polarity = 1):
+                 polarity = POLARITY_DEFAULT, phase = PHASE_DEFAULT, stb_polarity = 1, pin_group = None):
 
         self.stb_pin = stb_pin
         self.clk_pin = clk_pin
@@ -26,6 +26,13 @@ class ShiftRegister:
         self.phase = phase
         self.stb_polarity = stb_polarity
         self.bits = bits
+        self.pin_group = pin_group  # optional PinGroup of (clk, data, stb), set with one call per write.
+        self._stb_level = stb_polarity  # output pins can not be read back, the group writes carry this level.
+
+
+    def _stb(self, level):
+        self._stb_level = level
+        _ = self.stb_pin.high() if level else self.stb_pin.low()
 
 
     def _get_bits(self, value, lsbfirst):
@@ -35,16 +42,16 @@ class ShiftRegister:
     def write(self, bytes_array, lsbfirst = None):
 
         if self.stb_polarity == 0:
-            self.stb_pin.low()
-        self.stb_pin.high()
-        self.stb_pin.low()
+            self._stb(0)
+        self._stb(1)
+        self._stb(0)
 
         for b in bytes_array:
             self.shiftOut(b, lsbfirst = lsbfirst, drop_stb = False, raise_stb = False)
 
-        self.stb_pin.high()
+        self._stb(1)
         if self.stb_polarity == 0:
-            self.stb_pin.low()
+            self._stb(0)
 
 
     def shiftOut(self, value, lsbfirst = None, drop_stb = True, raise_stb = True):
@@ -54,8 +61,12 @@ class ShiftRegister:
 
         bits = self._get_bits(value, lsbfirst)
 
+        if self.pin_group is not None:
+            self._shift_out_grouped(bits, drop_stb, raise_stb)
+            return
+
         if drop_stb:
-            self.stb_pin.low()
+            self._stb(0)
 
         for i in range(len(bits)):
             if self.phase == 0:
@@ -68,7 +79,31 @@ class ShiftRegister:
             _ = self.clk_pin.low() if self.polarity == 0 else self.clk_pin.high()
 
         if raise_stb:
-            self.stb_pin.high()
+            self._stb(1)
+
+
+    def _shift_out_grouped(self, bits, drop_stb, raise_stb):
+        # clk and data change in the same call; stb is dropped by the first call if drop_stb, otherwise kept as is.
+        # phase 0: data changes with the trailing edge, so it is ready before the next leading edge.
+        # phase 1: data changes with the leading edge.
+        idle = self.polarity
+        active = 1 - idle
+        write = self.pin_group.write
+        stb = 0 if drop_stb else self._stb_level
+        self._stb_level = stb
+
+        if self.phase == 0:
+            write((idle, bits[0], stb))
+            for i in range(len(bits)):
+                write((active, bits[i], stb))
+                write((idle, bits[i + 1] if i + 1 < len(bits) else bits[i], stb))
+        else:
+            for bit in bits:
+                write((active, bit, stb))
+                write((idle, bit, stb))
+
+        if raise_stb:
+            self._stb(1)
 
 
     def shiftIn(self, lsbfirst = None, drop_stb = True, raise_stb = True):
@@ -77,20 +112,25 @@ class ShiftRegister:
         self.data_pin.high()  # need to pull high
 
         if drop_stb:
-            self.stb_pin.low()
+            self._stb(0)
 
         bits = 0
         for i in range(self.bits):
             self.clk_pin.low()
-            shift_bits = i if lsbfirst else self.bits - i
+            shift_bits = i if lsbfirst else self.bits - 1 - i
             bits = bits | self.data_pin.value() << shift_bits
             self.clk_pin.high()
 
         if raise_stb:
-            self.stb_pin.high()
+            self._stb(1)
 
         return bits
 
 
+    def readinto(self, buf, lsbfirst = None):
+        for i in range(len(buf)):
+            buf[i] = self.shiftIn(lsbfirst = lsbfirst, drop_stb = False, raise_stb = False)
+
+
     def clear(self, value = CLEAR_VALUE):
         self.shiftOut(value)